@@ -0,0 +1,556 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Benchmarks
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import random
+import select
+import getopt
+import platform
+import resource
+import threading
+
+from lib.gsmtap import *
+from lib.paging import *
+from lib.synth import *
+from lib.tmsiset import *
+from lib.stats import *
+from lib.log import *
+
+from sdr_tmsi_map import TMSIManager
+
+def legacy_tmsis(data):
+	# Reference: the copying decoder TMSIManager used to have
+	data = bytearray(data)
+	l3 = data[16:]
+	tmsis = []
+
+	if l3[1] != 0x06:
+		return tmsis
+
+	if l3[2] == 0x21:
+		mi_type = l3[5] & 0x07
+		msg_len = l3[0]
+		next_mi_index = None
+
+		if mi_type == 0x04:
+			tmsis.append(l3[6:10])
+			next_mi_index = 10
+		elif mi_type == 0x01:
+			next_mi_index = 13
+
+		if next_mi_index is not None:
+			if next_mi_index < (msg_len + 1) and l3[next_mi_index] == 0x17:
+				if l3[next_mi_index + 2] & 0x07 == 0x04:
+					a = next_mi_index + 3
+					b = next_mi_index + 7
+					tmsis.append(l3[a:b])
+	elif l3[2] == 0x22:
+		tmsis.append(l3[4:8])
+		tmsis.append(l3[8:12])
+		if l3[14] & 0x07 == 0x04:
+			tmsis.append(l3[15:19])
+	elif l3[2] == 0x24:
+		tmsis.append(l3[4:8])
+		tmsis.append(l3[8:12])
+		tmsis.append(l3[12:16])
+		tmsis.append(l3[16:20])
+
+	return tmsis
+
+def legacy_int_tmsis(data):
+	# The set engine needs integers, so convert
+	return [tmsi_to_int(tmsi) for tmsi in legacy_tmsis(data)]
+
+DECODERS = (
+	("legacy", legacy_tmsis),
+	("legacy-int", legacy_int_tmsis),
+	("decoder", gsmtap_paging_tmsis),
+)
+
+class QuietTMSIManager(TMSIManager):
+	# Console output isn't what we measure here
+	def print_tmsi(self, tmsi):
+		pass
+
+def best_of(rounds, func, setup = None):
+	best = None
+	for i in range(rounds):
+		# Not measured
+		if setup is not None:
+			setup()
+
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+
+		if best is None or elapsed < best:
+			best = elapsed
+
+	return best
+
+def bench_decode(corpus, rounds):
+	# Rounds are interleaved to reduce the impact of noise
+	best = {}
+	for i in range(rounds):
+		for name, decoder in DECODERS:
+			start = time.time()
+			for data in corpus:
+				for tmsi in decoder(data):
+					pass
+			elapsed = time.time() - start
+
+			if best.get(name) is None or elapsed < best[name]:
+				best[name] = elapsed
+
+	return dict((name, len(corpus) / best[name]) for name, d in DECODERS)
+
+INGEST_VARIANTS = (
+	# suffix, dedup, idle_filter
+	("", None, "exact"),
+	("-nodedup", 0, "exact"),
+	("-bloom", None, "bloom"),
+)
+
+def bench_ingest(corpus, idle_corpus, rounds, records, backend = "set"):
+	# Messages per second through handle_rx_data, with and without
+	# repeated pagings suppression, and with both IDLE filters.
+	# Frame numbers go on from pass to pass, so only repetitions
+	# within a corpus are suppressed
+	tmsis = [tmsi for data in corpus for tmsi in gsmtap_paging_tmsis(data)]
+	results = {}
+	for suffix, dedup, idle_filter in INGEST_VARIANTS:
+		mgr = QuietTMSIManager(0, dedup = dedup, idle_filter = idle_filter,
+			record_backend = backend)
+		frames = {"fn" : 0, "corpus" : None}
+
+		def setup(source, filled):
+			frames["corpus"] = renumber_corpus(source, frames["fn"])
+			frames["fn"] = fn_add(frames["fn"], len(source))
+
+			# Records of the recording corpus, as if they were
+			# recorded (which isn't measured here)
+			mgr.flush()
+			for i in range(filled):
+				mgr.start()
+				mgr.record = TMSISet(tmsis)
+				mgr.stop()
+
+		def feed():
+			for data in frames["corpus"]:
+				mgr.handle_rx_data(data)
+
+		# Recording mode
+		def record():
+			mgr.start()
+			feed()
+
+		results["recording" + suffix] = len(corpus) / best_of(rounds,
+			record, lambda: setup(corpus, 0))
+
+		# IDLE mode, with outsider filtering of other pagings,
+		# including a CROSS, so the bulk filter is applied
+		def idle():
+			feed()
+			mgr.cross()
+
+		results["idle" + suffix] = len(idle_corpus) / best_of(rounds,
+			idle, lambda: setup(idle_corpus, records))
+
+		mgr.shutdown()
+
+	return results
+
+def target_rank(ranked, target):
+	# Position of the target in a scored ranking (ties share
+	# the best position), None if absent
+	scores = dict(ranked)
+	if target not in scores:
+		return None
+	return 1 + sum(1 for tmsi, score in ranked if score > scores[target])
+
+def bench_cross(population, count, records, repeats, seed, loss = 0.0,
+			backend = "set"):
+	# Latency of stop() / cross() as the number of records grows
+	mgr = QuietTMSIManager(0, cross_mode = "score", record_backend = backend)
+	target = population[0]
+	rand = random.Random(seed)
+	results = []
+
+	# Frame numbers go on across rounds, like on air
+	fn = 0
+
+	for i in range(records):
+		# The target is paged in every round
+		corpus = paging_corpus(count, population, seed + i, repeats,
+			first_fn = fn)
+		fn = fn_add(fn, len(corpus))
+		corpus.append(gsmtap_frame(p1_frame(mi_tmsi(target)), fn))
+		fn = fn_add(fn, 1)
+
+		# Simulate decoding failures
+		if loss:
+			corpus = [data for data in corpus if rand.random() >= loss]
+
+		mgr.start()
+		for data in corpus:
+			mgr.handle_rx_data(data)
+
+		start = time.time()
+		mgr.stop()
+		stop_time = time.time() - start
+
+		# Some IDLE traffic without the target
+		idle = paging_corpus(count // 4, population[1:],
+			seed + records + i, repeats, first_fn = fn)
+		fn = fn_add(fn, len(idle))
+		for data in idle:
+			mgr.handle_rx_data(data)
+
+		start = time.time()
+		result = mgr.cross()
+		cross_time = time.time() - start
+
+		start = time.time()
+		mgr.cross_full()
+		cross_full_time = time.time() - start
+
+		start = time.time()
+		mgr.rank(mgr.rank_limit)
+		rank_time = time.time() - start
+
+		results.append({
+			"records" : len(mgr.records),
+			"stop_ms" : stop_time * 1000,
+			"cross_ms" : cross_time * 1000,
+			"cross_full_ms" : cross_full_time * 1000,
+			"candidates" : len(result),
+			"target_found" : target in result,
+			"rank_ms" : rank_time * 1000,
+			"target_rank" : target_rank(mgr.rank(), target),
+			"records_bytes" : sum(r.memory_usage() for r in mgr.records),
+		})
+
+	mgr.shutdown()
+	return results
+
+def bench_backends(population, count, records, rounds, seed):
+	# Memory and a full intersection over all records for every
+	# records backend, all of them holding the same TMSIs
+	target = population[0]
+	sets = []
+	for i in range(records):
+		record = TMSISet([target])
+		for data in paging_corpus(count, population, seed + i):
+			for tmsi in gsmtap_paging_tmsis(data):
+				record.add(tmsi)
+		sets.append(record)
+
+	results = {}
+	for backend in RECORD_BACKENDS:
+		if backend == "numpy" and numpy is None:
+			continue
+
+		record_class = TMSIManager.record_classes.get(backend)
+		if record_class is None:
+			recs = [record.copy() for record in sets]
+		else:
+			recs = [record_class(record) for record in sets]
+
+		result = []
+		def fold():
+			tmsis = recs[0].copy()
+			for record in recs[1:]:
+				tmsis.intersection_update(record)
+			result[:] = tmsis.sorted()
+
+		results[backend] = {
+			"cross_full_ms" : best_of(rounds, fold) * 1000,
+			"records_bytes" : sum(r.memory_usage() for r in recs),
+			"target_found" : target in result,
+		}
+
+	return results
+
+def cpu_time():
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+def bench_flowgraph(iq_path, iq_fc, samp_rate, carriers):
+	# GNU Radio flowgraph throughput, reading IQ samples
+	# from a file as fast as possible
+	from lib.radio import RadioInterface
+
+	stats = Stats()
+	mgr = QuietTMSIManager(0, stats = stats)
+	port = mgr.sock.getsockname()[1]
+
+	radio = RadioInterface("", "", samp_rate, 0, 0, port,
+		carriers, iq_path, iq_fc, 0)
+	samples = os.path.getsize(iq_path) // 8
+
+	start = time.time()
+	start_cpu = cpu_time()
+
+	# Wait for the end of file in background
+	radio.start()
+	waiter = threading.Thread(target = radio.wait)
+	waiter.start()
+
+	# Receive while running, then until the socket is silent
+	while True:
+		r_event, w_event, x_event = select.select([mgr.sock], [], [], 0.2)
+		if r_event:
+			mgr.handle_rx_event()
+		elif not waiter.is_alive():
+			break
+
+	elapsed = time.time() - start
+	cpu = cpu_time() - start_cpu
+	channels = len(carriers) if carriers is not None else 1
+
+	mgr.shutdown()
+	return {
+		"samples" : samples,
+		"carriers" : channels,
+		"elapsed_s" : elapsed,
+		"cpu_s" : cpu,
+		"samples_per_s" : samples / elapsed,
+		"realtime_factor" : samples / elapsed / samp_rate,
+		# Cores needed per carrier to keep up in real time
+		"cpu_per_carrier" : cpu / (float(samples) / samp_rate) / channels,
+		"datagrams" : stats.counters.get("rx_datagrams", 0),
+		"tmsis" : stats.counters.get("tmsis", 0),
+	}
+
+BENCHMARKS = ("decode", "ingest", "cross", "backends", "flowgraph")
+RECORD_BACKENDS = ("set", "array", "numpy")
+
+class Application:
+	count = 100000
+	population = 10000
+	repeats = 1
+	records = 16
+	rounds = 10
+	loss = 0.0
+	seed = 0
+	backend = "set"
+	output = None
+	benchmarks = BENCHMARKS[:4]
+
+	# Flowgraph specific
+	iq_path = None
+	iq_fc = None
+	samp_rate = 2000000
+	carriers = None
+
+	def __init__(self):
+		self.parse_argv()
+
+	def run(self):
+		# Keep stdout clean for JSON output
+		stdout = sys.stdout
+		if self.output == "-":
+			sys.stdout = sys.stderr
+
+		population = tmsi_population(self.population, self.seed)
+		corpus = paging_corpus(self.count, population,
+			self.seed, self.repeats)
+
+		results = {
+			"timestamp" : time.time(),
+			"python" : platform.python_version(),
+			"platform" : platform.platform(),
+			"params" : {
+				"count" : self.count,
+				"population" : self.population,
+				"repeats" : self.repeats,
+				"records" : self.records,
+				"rounds" : self.rounds,
+				"loss" : self.loss,
+				"seed" : self.seed,
+				"backend" : self.backend,
+			},
+		}
+
+		print "Synthetic corpus: %d datagrams, %d distinct TMSIs" \
+			% (len(corpus), self.population)
+
+		if "decode" in self.benchmarks:
+			print "Decoding, best of %d rounds" % self.rounds
+			results["decode"] = bench_decode(corpus, self.rounds)
+			for name, rate in sorted(results["decode"].items()):
+				print "  %-12s %12.0f msg/s" % (name, rate)
+
+		if "ingest" in self.benchmarks:
+			print "TMSIManager.handle_rx_data, best of %d rounds" \
+				% self.rounds
+			idle_corpus = paging_corpus(self.count, population,
+				self.seed + 1, self.repeats)
+			results["ingest"] = bench_ingest(corpus, idle_corpus,
+				self.rounds, self.records, self.backend)
+			for name, rate in sorted(results["ingest"].items()):
+				print "  %-18s %12.0f msg/s" % (name, rate)
+
+		if "cross" in self.benchmarks:
+			print "Intersection, %d datagrams per record" % self.count
+			results["cross"] = bench_cross(population, self.count,
+				self.records, self.repeats, self.seed, self.loss,
+				self.backend)
+			print "  %7s %10s %10s %10s %10s %6s %10s %6s %12s" % ("records",
+				"stop ms", "cross ms", "full ms", "candidates", "target",
+				"rank ms", "rank", "bytes")
+			for r in results["cross"]:
+				print "  %7d %10.3f %10.3f %10.3f %10d %6s %10.3f %6s %12d" \
+					% (r["records"], r["stop_ms"], r["cross_ms"],
+					r["cross_full_ms"], r["candidates"],
+					"yes" if r["target_found"] else "no", r["rank_ms"],
+					r["target_rank"], r["records_bytes"])
+
+		if "backends" in self.benchmarks:
+			print "Records backends, %d records, best of %d rounds" \
+				% (self.records, self.rounds)
+			results["backends"] = bench_backends(population, self.count,
+				self.records, self.rounds, self.seed)
+			print "  %-8s %12s %10s %6s" % ("backend", "bytes",
+				"full ms", "target")
+			for name in RECORD_BACKENDS:
+				r = results["backends"].get(name)
+				if r is None:
+					print "  %-8s %12s" % (name, "unavailable")
+					continue
+
+				print "  %-8s %12d %10.3f %6s" % (name, r["records_bytes"],
+					r["cross_full_ms"], "yes" if r["target_found"] else "no")
+
+		if "flowgraph" in self.benchmarks:
+			print "Flowgraph, reading '%s' at max speed" % self.iq_path
+			results["flowgraph"] = bench_flowgraph(self.iq_path,
+				self.iq_fc, self.samp_rate, self.carriers)
+			for name, value in sorted(results["flowgraph"].items()):
+				print "  %-16s %14.3f" % (name, value)
+
+		# Peak resident set size of the whole process
+		results["peak_rss_kb"] = resource.getrusage(
+			resource.RUSAGE_SELF).ru_maxrss
+
+		if self.output == "-":
+			sys.stdout = stdout
+			print json.dumps(results, indent=2, sort_keys=True)
+		elif self.output is not None:
+			with open(self.output, "w") as f:
+				json.dump(results, f, indent=2, sort_keys=True)
+
+	def print_help(self):
+		s  = " Usage: " + sys.argv[0] + " [options]\n\n" \
+			 " Some help...\n" \
+			 "  -h --help         this text\n" \
+			 "  -b --bench        Comma separated list of benchmarks\n" \
+			 "                    (default %s)\n" % ",".join(BENCHMARKS[:4]) + \
+			 "  -o --output       Write JSON results into a file ('-' for stdout)\n\n"
+
+		s += " Synthetic traffic specific\n" \
+			 "  -n --count        Number of pagings (default 100000)\n" \
+			 "  -P --population   Number of distinct TMSIs (default 10000)\n" \
+			 "  -R --repeats      Number of repetitions per paging (default 1)\n" \
+			 "  -N --records      Number of records to cross (default 16)\n" \
+			 "  -r --rounds       Number of rounds (default 10)\n" \
+			 "     --loss         Probability to lose a datagram (default 0)\n" \
+			 "     --seed         Random seed (default 0)\n" \
+			 "     --backend      Records backend for ingest and cross,\n" \
+			 "                    set, array or numpy (default set)\n\n"
+
+		s += " Flowgraph specific (needs GR-GSM)\n" \
+			 "     --iq-file      Recorded complex64 samples\n" \
+			 "     --iq-fc        Center frequency of the recording in kHz\n" \
+			 "     --sample-rate  Sample rate of the recording (default 2000000)\n" \
+			 "     --carriers     Comma separated list of carriers in kHz\n" \
+			 "                    (default is the center frequency only)\n"
+
+		print s
+
+	def parse_argv(self):
+		try:
+			opts, args = getopt.getopt(sys.argv[1:],
+				"b:o:n:P:R:N:r:h", ["help", "bench=", "output=",
+				"count=", "population=", "repeats=", "records=",
+				"rounds=", "seed=", "loss=", "backend=", "iq-file=", "iq-fc=",
+				"sample-rate=", "carriers="])
+		except getopt.GetoptError as err:
+			# Print help and exit
+			self.print_help()
+			print "[!] " + str(err)
+			sys.exit(2)
+
+		for o, v in opts:
+			if o in ("-h", "--help"):
+				self.print_help()
+				sys.exit(2)
+			elif o in ("-b", "--bench"):
+				self.benchmarks = v.split(",")
+				for name in self.benchmarks:
+					if name not in BENCHMARKS:
+						print "[!] Unknown benchmark '%s'" % name
+						sys.exit(2)
+			elif o in ("-o", "--output"):
+				self.output = v
+			elif o in ("-n", "--count"):
+				self.count = int(v)
+			elif o in ("-P", "--population"):
+				self.population = int(v)
+			elif o in ("-R", "--repeats"):
+				self.repeats = int(v)
+			elif o in ("-N", "--records"):
+				self.records = int(v)
+			elif o in ("-r", "--rounds"):
+				self.rounds = int(v)
+			elif o == "--seed":
+				self.seed = int(v)
+			elif o == "--loss":
+				self.loss = float(v)
+			elif o == "--backend":
+				if v not in RECORD_BACKENDS:
+					print "[!] Records backend should be set, array or numpy"
+					sys.exit(2)
+				self.backend = v
+			elif o == "--iq-file":
+				self.iq_path = v
+			elif o == "--iq-fc":
+				self.iq_fc = int(v) * 1000
+			elif o == "--sample-rate":
+				self.samp_rate = int(v)
+			elif o == "--carriers":
+				self.carriers = [int(fc) * 1000 for fc in v.split(",")]
+
+		if "flowgraph" in self.benchmarks and \
+				(self.iq_path is None or self.iq_fc is None):
+			print "[!] Flowgraph benchmark needs --iq-file and --iq-fc"
+			sys.exit(2)
+
+if __name__ == '__main__':
+	Application().run()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Paging Request decoder fuzzing
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+import random
+import getopt
+import binascii
+
+from lib.gsmtap import *
+from lib.paging import *
+from lib.synth import *
+
+def random_mi(rand):
+	# Returns an encoded MI and its expected (mi_type, value)
+	kind = rand.randint(0, 4)
+	if kind == 0:
+		tmsi = rand.getrandbits(32)
+		return mi_tmsi(tmsi), (GSM_MI_TYPE_TMSI, tmsi)
+	elif kind == 1:
+		imsi = random_digits(rand, rand.randint(6, 15))
+		return mi_imsi(imsi), (GSM_MI_TYPE_IMSI, imsi)
+	elif kind == 2:
+		imei = random_digits(rand, 15)
+		return mi_imei(imei), (GSM_MI_TYPE_IMEI, imei)
+	elif kind == 3:
+		imeisv = random_digits(rand, 16)
+		return mi_imeisv(imeisv), (GSM_MI_TYPE_IMEISV, imeisv)
+
+	return mi_none(), (GSM_MI_TYPE_NONE, None)
+
+def random_request(rand):
+	# Returns a valid Paging Request and its expected identities
+	while True:
+		frame, expected = random_layout(rand)
+		# Long MIs don't always fit into a MAC block together
+		if len(frame) == GSM_MACBLOCK_LEN:
+			return frame, expected
+
+def random_layout(rand):
+	kind = rand.randint(1, 3)
+	if kind == 1:
+		mi1, expected = random_mi(rand)
+		expected = [expected]
+		mi2 = None
+		if rand.randint(0, 1):
+			mi2, mi = random_mi(rand)
+			expected.append(mi)
+		return p1_frame(mi1, mi2 = mi2), expected
+	elif kind == 2:
+		tmsis = [rand.getrandbits(32) for i in range(2)]
+		expected = [(GSM_MI_TYPE_TMSI, x) for x in tmsis]
+		mi3 = None
+		if rand.randint(0, 1):
+			mi3, mi = random_mi(rand)
+			expected.append(mi)
+		return p2_frame(tmsis[0], tmsis[1], mi3 = mi3), expected
+
+	tmsis = [rand.getrandbits(32) for i in range(4)]
+	return p3_frame(*tmsis), [(GSM_MI_TYPE_TMSI, x) for x in tmsis]
+
+def mutate(rand, frame):
+	frame = bytearray(frame)
+	kind = rand.randint(0, 3)
+	if kind == 0:
+		# Bit errors
+		for i in range(rand.randint(1, 3)):
+			frame[rand.randrange(len(frame))] ^= 1 << rand.randint(0, 7)
+	elif kind == 1:
+		# Any value in a header or length field
+		pos = rand.choice([0, 4, 5, 10, 11, 12, 13, 14])
+		frame[pos] = rand.randint(0, 255)
+	elif kind == 2:
+		# Truncated
+		frame = frame[:rand.randrange(len(frame))]
+	else:
+		# Garbage behind a valid header
+		for i in range(3, len(frame)):
+			frame[i] = rand.randint(0, 255)
+
+	return frame
+
+def request_tmsis(request):
+	# What the fast path should return for a given full decode
+	if request is None:
+		return ()
+	return tuple(value for mi_type, value in request[2]
+		if mi_type == GSM_MI_TYPE_TMSI)
+
+class Application:
+	count = 100000
+	seed = 0
+	verbose = False
+
+	def __init__(self):
+		self.parse_argv()
+
+	def check(self, frame, expected = None):
+		# Returns an error description, or None
+		try:
+			request = paging_request(frame)
+			tmsis = paging_tmsis(frame)
+			gsmtap_tmsis = gsmtap_paging_tmsis(gsmtap_frame(frame))
+		except Exception as e:
+			return "%s: %s" % (e.__class__.__name__, e)
+
+		if expected is not None:
+			if request is None:
+				return "valid frame rejected"
+			if request[2] != expected:
+				return "identities %r != %r" % (request[2], expected)
+
+		if tmsis != request_tmsis(request):
+			return "fast path %r != %r" % (tmsis, request_tmsis(request))
+		if gsmtap_tmsis != tmsis:
+			return "GSMTAP path %r != %r" % (gsmtap_tmsis, tmsis)
+
+		return None
+
+	def run(self):
+		rand = random.Random(self.seed)
+		failures = 0
+		rejected = 0
+
+		for i in range(self.count):
+			frame, expected = random_request(rand)
+			error = self.check(frame, expected)
+
+			if error is None:
+				frame = mutate(rand, frame)
+				error = self.check(frame)
+				if paging_request(frame) is None:
+					rejected += 1
+
+			if error is not None:
+				failures += 1
+				if self.verbose or failures <= 10:
+					print "[!] %s: %s" % (binascii.hexlify(frame), error)
+
+		print "%d frames, %d mutations, %d rejected, %d failures" \
+			% (self.count, self.count, rejected, failures)
+
+		if failures:
+			sys.exit(1)
+
+	def print_help(self):
+		s  = " Usage: " + sys.argv[0] + " [options]\n\n" \
+			 " Some help...\n" \
+			 "  -h --help         this text\n" \
+			 "  -n --count        Number of frames (default 100000)\n" \
+			 "  -v --verbose      Print every failure\n" \
+			 "     --seed         Random seed (default 0)\n"
+
+		print s
+
+	def parse_argv(self):
+		try:
+			opts, args = getopt.getopt(sys.argv[1:],
+				"n:vh", ["help", "count=", "verbose", "seed="])
+		except getopt.GetoptError as err:
+			# Print help and exit
+			self.print_help()
+			print "[!] " + str(err)
+			sys.exit(2)
+
+		for o, v in opts:
+			if o in ("-h", "--help"):
+				self.print_help()
+				sys.exit(2)
+			elif o in ("-n", "--count"):
+				self.count = int(v)
+			elif o in ("-v", "--verbose"):
+				self.verbose = True
+			elif o == "--seed":
+				self.seed = int(v)
+
+if __name__ == '__main__':
+	Application().run()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# GSM band plan (3GPP TS 45.005)
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Channel spacing
+CHANNEL_WIDTH = 200000
+
+# Frequencies in kHz are never that small
+ARFCN_MAX = 1023
+
+# (first ARFCN, last ARFCN, downlink of the first one in Hz),
+# E-GSM ARFCNs 975..1023 come before ARFCN 0
+BANDS = {
+	"GSM850" : [(128, 251, 869200000)],
+	"GSM900" : [(0, 124, 935000000), (955, 1023, 921200000)],
+	"DCS1800" : [(512, 885, 1805200000)],
+	"PCS1900" : [(512, 810, 1930200000)],
+}
+
+# DCS1800 and PCS1900 share ARFCNs, so one of them
+# has to be chosen explicitly to avoid ambiguity
+DEFAULT_BANDS = ("GSM850", "GSM900", "DCS1800")
+
+# GSMTAP flags PCS1900 ARFCNs for the same reason
+GSMTAP_ARFCN_PCS = 0x8000
+
+# Precomputed lookup tables
+DOWNLINK = {}
+ARFCNS = {}
+
+for band, ranges in BANDS.items():
+	DOWNLINK[band] = {}
+	for first, last, freq in ranges:
+		for arfcn in range(first, last + 1):
+			dl = freq + (arfcn - first) * CHANNEL_WIDTH
+			DOWNLINK[band][arfcn] = dl
+			ARFCNS[dl] = (band, arfcn)
+
+def band_arfcns(band):
+	if band not in BANDS:
+		raise Exception("Unknown band '%s'" % band)
+	return sorted(DOWNLINK[band].keys())
+
+def lookup_arfcn(arfcn, band = None):
+	# Downlink frequency in Hz, or None if unknown
+	bands = DEFAULT_BANDS if band is None else (band, )
+	for band in bands:
+		freq = DOWNLINK.get(band, {}).get(arfcn)
+		if freq is not None:
+			return freq
+
+	return None
+
+def arfcn_to_freq(arfcn, band = None):
+	freq = lookup_arfcn(arfcn, band)
+	if freq is None:
+		raise Exception("Unknown ARFCN %d" % arfcn)
+	return freq
+
+def freq_to_arfcn(freq):
+	# Returns (band, arfcn), or None if off the raster
+	return ARFCNS.get(int(freq))
+
+def gsmtap_arfcn(freq):
+	# ARFCN for GSMTAP headers (tells carriers apart),
+	# or 0 if off the raster
+	found = freq_to_arfcn(freq)
+	if found is None:
+		return 0
+
+	band, arfcn = found
+	if band == "PCS1900":
+		arfcn |= GSMTAP_ARFCN_PCS
+	return arfcn
+
+def parse_freq(value, band = None):
+	# Either an ARFCN, or a frequency in kHz
+	value = int(value)
+	if value <= ARFCN_MAX:
+		return arfcn_to_freq(value, band)
+	return value * 1000
+
+def parse_channels(token):
+	# ARFCN, frequency in kHz, ARFCN range "N-M" or a band name,
+	# optionally prefixed with a band, e.g. "PCS1900:512-520"
+	band = None
+	if ":" in token:
+		band, token = token.split(":", 1)
+		if band not in BANDS:
+			raise Exception("Unknown band '%s'" % band)
+
+	if token in BANDS:
+		band = token
+		return [arfcn_to_freq(arfcn, band) for arfcn in band_arfcns(band)]
+
+	if "-" in token:
+		# Gaps between bands are skipped
+		first, last = [int(x) for x in token.split("-", 1)]
+		freqs = [lookup_arfcn(arfcn, band)
+			for arfcn in range(first, last + 1)]
+		return [freq for freq in freqs if freq is not None]
+
+	return [parse_freq(token, band)]
+
+def describe_freq(freq):
+	result = freq_to_arfcn(freq)
+	if result is None:
+		return "%d Hz" % freq
+	return "ARFCN %d (%s, %d Hz)" % (result[1], result[0], freq)
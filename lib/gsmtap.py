@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# GSMTAP header decoder
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+GSMTAP_VERSION = 0x02
+GSMTAP_TYPE_UM = 0x01
+
+# version, hdr_len, type, timeslot, arfcn, signal_dbm, snr_db,
+# frame_number, sub_type, antenna_nr, sub_slot, res
+GSMTAP_HDR = struct.Struct(">BBBBHbbIBBBB")
+GSMTAP_PREFIX = struct.Struct("BBB")
+GSMTAP_FN = struct.Struct(">I")
+GSMTAP_FN_OFFSET = 8
+GSMTAP_CLOCK = struct.Struct(">H2xI")
+GSMTAP_CLOCK_OFFSET = 4
+
+# TDMA frame numbers wrap every hyperframe,
+# one frame takes 60 / 13 ms
+GSM_HYPERFRAME = 2715648
+GSM_FRAME_RATE = 13000 / 60.0
+
+def gsmtap_header(buf):
+	return GSMTAP_HDR.unpack_from(buf)
+
+def gsmtap_l3_offset(buf):
+	# Returns payload offset, or None if this isn't GSMTAP Um
+	if len(buf) < GSMTAP_HDR.size:
+		return None
+
+	version, hdr_len, gsmtap_type = GSMTAP_PREFIX.unpack_from(buf)
+	if version != GSMTAP_VERSION or gsmtap_type != GSMTAP_TYPE_UM:
+		return None
+
+	# Header length is given in 32-bit words
+	hdr_len <<= 2
+	if hdr_len < GSMTAP_HDR.size or hdr_len > len(buf):
+		return None
+
+	return hdr_len
+
+def gsmtap_fn(buf):
+	return GSMTAP_FN.unpack_from(buf, GSMTAP_FN_OFFSET)[0]
+
+def gsmtap_clock(buf):
+	# (ARFCN, frame number), every carrier has its own clock
+	return GSMTAP_CLOCK.unpack_from(buf, GSMTAP_CLOCK_OFFSET)
+
+def fn_diff(a, b):
+	# Signed distance from b to a, aware of wrapping
+	diff = (a - b) % GSM_HYPERFRAME
+	if diff > GSM_HYPERFRAME // 2:
+		diff -= GSM_HYPERFRAME
+	return diff
+
+def fn_add(fn, frames):
+	return (fn + frames) % GSM_HYPERFRAME
+
+def gsmtap_payload(buf):
+	# Returns a view on the payload (no copying)
+	offset = gsmtap_l3_offset(buf)
+	if offset is None:
+		return None
+
+	return memoryview(buf)[offset:]
@@ -23,6 +23,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
+import time
+import threading
+import collections
+
 DAPP = "\033[1;35m" # Application messages
 DGSM = "\033[1;33m" # Radio interface messages
 DCTL = "\033[1;37m" # Control interface messages
@@ -34,5 +39,123 @@ DINFO = "[i] "
 DERROR = "[!] "
 DPAGING = "[+] "
 
-def printl(cat, level, msg):
+class LogBackend:
+	# Max number of pending messages
+	ring_size = 8192
+	# How often the writer wakes up (in seconds)
+	flush_interval = 0.05
+
+	def __init__(self, path = None):
+		self.ring = collections.deque(maxlen = self.ring_size)
+		self.dropped = 0
+
+		# Disabled categories / levels, and sampling rates
+		self.disabled = set()
+		self.sampling = {}
+		self.sample_cnt = {}
+
+		# Optional file sink (no colors)
+		self.file = open(path, "a") if path is not None else None
+
+		self.stop_event = threading.Event()
+		self.thread = threading.Thread(target = self.writer)
+		self.thread.daemon = True
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		self.stop_event.set()
+		self.thread.join()
+		self.flush()
+
+		if self.file is not None:
+			self.file.close()
+
+	def disable(self, key):
+		# Either a category, or a level
+		self.disabled.add(key)
+
+	def sample(self, level, rate):
+		# Let only one of each rate messages through
+		self.sampling[level] = rate
+		self.sample_cnt[level] = 0
+
+	def emit(self, cat, level, msg, args):
+		if cat in self.disabled or level in self.disabled:
+			return
+
+		rate = self.sampling.get(level)
+		if rate is not None:
+			cnt = self.sample_cnt[level]
+			self.sample_cnt[level] = cnt + 1
+			if cnt % rate:
+				return
+
+		# Never block, the oldest message is lost on overflow
+		if len(self.ring) == self.ring_size:
+			self.dropped += 1
+		self.ring.append((time.time(), cat, level, msg, args))
+
+	def writer(self):
+		while not self.stop_event.is_set():
+			self.flush()
+			self.stop_event.wait(self.flush_interval)
+
+	def flush(self):
+		lines = []
+		file_lines = []
+
+		while True:
+			try:
+				ts, cat, level, msg, args = self.ring.popleft()
+			except IndexError:
+				break
+
+			# Formatting is deferred until here
+			if args:
+				msg = msg % args
+
+			lines.append(cat + level + msg + ENDC + "\n")
+			if self.file is not None:
+				file_lines.append("%.6f %s%s\n" % (ts, level, msg))
+
+		if self.dropped:
+			msg = "%d log messages dropped" % self.dropped
+			lines.append(DAPP + DERROR + msg + ENDC + "\n")
+			if self.file is not None:
+				file_lines.append("%.6f %s%s\n" % (time.time(), DERROR, msg))
+			self.dropped = 0
+
+		if lines:
+			sys.stdout.write("".join(lines))
+			sys.stdout.flush()
+		if file_lines:
+			self.file.write("".join(file_lines))
+			self.file.flush()
+
+# Messages are printed synchronously until a backend is started
+backend = None
+
+def log_start(path = None):
+	global backend
+
+	backend = LogBackend(path)
+	backend.start()
+	return backend
+
+def log_stop():
+	global backend
+
+	if backend is not None:
+		backend.stop()
+		backend = None
+
+def printl(cat, level, msg, *args):
+	if backend is not None:
+		backend.emit(cat, level, msg, args)
+		return
+
+	if args:
+		msg = msg % args
 	print cat + level + msg + ENDC
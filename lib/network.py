@@ -26,13 +26,63 @@
 
 import socket
 import select
+import struct
+import errno
 
 from log import *
 
+# Linux specific, not exported by the socket module
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+
+# Control protocol framing: type, payload length
+FRAME_HDR = struct.Struct(">BI")
+FRAME_MAX_LEN = 1 << 24
+
+# Frame types
+FRAME_TEXT = 0x00	# Commands and text responses
+FRAME_TMSIS = 0x01	# Packed uint32 TMSI array (CROSS result)
+FRAME_SCORES = 0x02	# Packed (TMSI, score) pairs (scored CROSS result)
+
+def pack_frame(payload, ftype = FRAME_TEXT):
+	return FRAME_HDR.pack(ftype, len(payload)) + payload
+
+class FrameReader:
+	def __init__(self):
+		# Incomplete frame(s) received so far, appended
+		# in place, so big frames aren't copied per segment
+		self.buf = bytearray()
+
+	def feed(self, data):
+		# Returns a list of complete (type, payload) frames
+		buf = self.buf
+		buf += data
+		frames = []
+		offset = 0
+
+		while len(buf) - offset >= FRAME_HDR.size:
+			ftype, length = FRAME_HDR.unpack_from(buf, offset)
+			if length > FRAME_MAX_LEN:
+				raise Exception("Frame is too long (%d)" % length)
+
+			end = offset + FRAME_HDR.size + length
+			if len(buf) < end:
+				break
+
+			frames.append((ftype, str(buf[offset + FRAME_HDR.size:end])))
+			offset = end
+
+		if offset:
+			del buf[:offset]
+		return frames
+
 class UDPServer:
 	udp_rx_size = 1024
 
-	def __init__(self, bind_port, remote_addr=False, remote_port=False):
+	# Max number of datagrams per wake-up (0 disables batching)
+	udp_rx_batch = 0
+
+	def __init__(self, bind_port, remote_addr=False, remote_port=False,
+				rx_batch=None, rx_rcvbuf=None):
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 		self.sock.bind(('0.0.0.0', bind_port))
 		self.sock.setblocking(0)
@@ -41,12 +91,79 @@ class UDPServer:
 		self.udp_remote_addr = remote_addr
 		self.udp_remote_port = remote_port
 
+		# Kernel drop counter (None if not available)
+		self.rx_drops = None
+
+		if rx_rcvbuf:
+			self.set_rcvbuf(rx_rcvbuf)
+		if rx_batch is not None:
+			self.udp_rx_batch = rx_batch
+
+		# Preallocate receive buffers
+		self.rx_pool = [memoryview(bytearray(self.udp_rx_size))
+			for i in range(self.udp_rx_batch)]
+
+		# recvmsg() is required to get SO_RXQ_OVFL ancillary data
+		self.rx_ovfl = False
+		if self.udp_rx_batch and hasattr(self.sock, "recvmsg_into"):
+			try:
+				self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+				self.rx_ancbufsize = socket.CMSG_SPACE(4)
+				self.rx_ovfl = True
+				self.rx_drops = 0
+			except socket.error:
+				pass
+
+	def set_rcvbuf(self, size):
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+	def get_rcvbuf(self):
+		return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
 	def close(self):
 		self.sock.close();
 
 	def handle_rx_event(self):
-		data, addr = self.sock.recvfrom(self.udp_rx_size)
-		self.handle_rx_data(data)
+		# Legacy mode: one datagram per wake-up, still passed as
+		# a batch, so per-batch housekeeping is done either way
+		if not self.udp_rx_batch:
+			data, addr = self.sock.recvfrom(self.udp_rx_size)
+			self.handle_rx_batch([data])
+			return
+
+		# Drain as many datagrams as we can
+		batch = []
+		for buf in self.rx_pool:
+			try:
+				if self.rx_ovfl:
+					length = self.recv_ovfl(buf)
+				else:
+					length = self.sock.recv_into(buf)
+			except socket.error as e:
+				if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+					break
+				raise
+
+			batch.append(buf[:length])
+
+		if batch:
+			self.handle_rx_batch(batch)
+
+	def recv_ovfl(self, buf):
+		length, ancdata, flags, addr = self.sock.recvmsg_into(
+			[buf], self.rx_ancbufsize)
+
+		# The kernel reports a total number of dropped datagrams
+		for level, type, data in ancdata:
+			if level == socket.SOL_SOCKET and type == SO_RXQ_OVFL:
+				self.rx_drops = struct.unpack("I", data[:4])[0]
+
+		return length
+
+	# NOTE: buffers are reused, so they shall not be kept
+	def handle_rx_batch(self, batch):
+		for data in batch:
+			self.handle_rx_data(data)
 
 	def handle_rx_data(self, data):
 		raise NotImplementedError
@@ -58,14 +175,21 @@ class UDPServer:
 		self.sock.sendto(data, (self.udp_remote_addr, self.udp_remote_port))
 
 class TCPServer:
-	tcp_rx_size = 1024
-	connections = []
+	tcp_rx_size = 65536
 	max_conn = 10
 
-	def __init__(self):
+	def __init__(self, max_conn = None):
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
+		if max_conn is not None:
+			self.max_conn = max_conn
+
+		# Per-instance connection list, pending output and input
+		self.connections = []
+		self.tx_queues = {}
+		self.rx_frames = {}
+
 	def listen(self, bind_port, bind_host = "0.0.0.0"):
 		self.sock.bind((bind_host, bind_port))
 		self.sock.listen(self.max_conn)
@@ -75,50 +199,103 @@ class TCPServer:
 		# Attempt to accept a new connection
 		sockfd, addr = self.sock.accept()
 
+		# Respect the connection limit
+		if len(self.connections) >= self.max_conn:
+			printl(DCTL, DERROR, "Too many connections, rejecting %s:%s"
+				% addr)
+			sockfd.close()
+			return
+
 		# Register this connection
+		sockfd.setblocking(0)
 		self.connections.append(sockfd)
+		self.tx_queues[sockfd] = ""
+		self.rx_frames[sockfd] = FrameReader()
 		printl(DCTL, DINFO, "New connection from %s:%s" % addr)
 
+	def drop(self, sock):
+		sock.close()
+		self.connections.remove(sock)
+		del self.tx_queues[sock]
+		del self.rx_frames[sock]
+		self.handle_close_event()
+
 	def handle_rx_event(self, socks):
 		# Find all ready to read sockets
-		for sock in self.connections:
+		for sock in list(self.connections):
 			# Ok, we found one
 			if sock in socks:
-				data = sock.recv(self.tcp_rx_size)
+				try:
+					data = sock.recv(self.tcp_rx_size)
+				except socket.error:
+					data = ""
 
 				# Detect connection close
 				if len(data) == 0:
-					self.connections.remove(sock)
-					self.handle_close_event()
-				else:
-					self.handle_rx_data(data)
+					self.drop(sock)
+					continue
+
+				# Reassemble frames, there may be several
+				try:
+					frames = self.rx_frames[sock].feed(data)
+				except Exception as e:
+					printl(DCTL, DERROR, str(e))
+					self.drop(sock)
+					continue
+
+				for ftype, payload in frames:
+					self.handle_rx_frame(sock, ftype, payload)
+
+	def tx_pending(self):
+		# Connections waiting to become writable
+		return [sock for sock in self.connections if self.tx_queues[sock]]
+
+	def handle_tx_event(self, socks):
+		for sock in list(self.connections):
+			if sock in socks:
+				self.flush(sock)
 
-	def send(self, sock, data):
+	def flush(self, sock):
+		# Never block, the rest is sent when writable
 		try:
-			sock.send(data)
-		except:
-			sock.close()
-			self.connections.remove(sock)
-			self.handle_close_event()
+			sent = sock.send(self.tx_queues[sock])
+		except socket.error as e:
+			if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+				return
+			self.drop(sock)
+			return
 
-	def broadcast(self, data):
-		for sock in self.connections:
-			self.send(sock, data)
+		self.tx_queues[sock] = self.tx_queues[sock][sent:]
 
-	def handle_rx_data(self, data):
+	def send(self, sock, data, ftype = FRAME_TEXT):
+		# It may have been dropped in the meantime
+		if sock not in self.tx_queues:
+			return
+
+		self.tx_queues[sock] += pack_frame(data, ftype)
+		self.flush(sock)
+
+	def broadcast(self, data, ftype = FRAME_TEXT):
+		for sock in list(self.connections):
+			self.send(sock, data, ftype)
+
+	def handle_rx_frame(self, sock, ftype, payload):
 		raise NotImplementedError
 
 	def handle_close_event(self):
 		raise NotImplementedError
 
 	def close(self):
+		for sock in self.connections:
+			sock.close()
 		self.sock.close();
 
 class TCPClient:
-	tcp_rx_size = 1024
+	tcp_rx_size = 65536
 
 	def __init__(self):
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.rx_frames = FrameReader()
 
 	def connect(self, remote_addr, remote_port):
 		printl(DCTL, DINFO, "Connecting to %s:%d..."
@@ -139,14 +316,24 @@ class TCPClient:
 		# Detect connection close
 		if len(data) == 0:
 			self.handle_close_event()
-		else:
-			self.handle_rx_data(data)
+			return
 
-	def handle_rx_data(self, data):
+		# Reassemble frames, there may be several
+		try:
+			frames = self.rx_frames.feed(data)
+		except Exception as e:
+			printl(DCTL, DERROR, str(e))
+			self.handle_close_event()
+			return
+
+		for ftype, payload in frames:
+			self.handle_rx_frame(ftype, payload)
+
+	def handle_rx_frame(self, ftype, payload):
 		raise NotImplementedError
 
 	def handle_close_event(self):
 		raise NotImplementedError
 
-	def send(self, data):
-		self.sock.send(data)
+	def send(self, data, ftype = FRAME_TEXT):
+		self.sock.sendall(pack_frame(data, ftype))
@@ -0,0 +1,333 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Paging Request decoder
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+from gsmtap import *
+
+# CCCH messages are always padded to this length
+GSM_MACBLOCK_LEN = 23
+
+GSM48_PDISC_RR = 0x06
+
+GSM48_MT_RR_PAG_REQ_1 = 0x21
+GSM48_MT_RR_PAG_REQ_2 = 0x22
+GSM48_MT_RR_PAG_REQ_3 = 0x24
+
+# Paging Request types by message type
+PAGING_TYPES = {
+	GSM48_MT_RR_PAG_REQ_1 : 1,
+	GSM48_MT_RR_PAG_REQ_2 : 2,
+	GSM48_MT_RR_PAG_REQ_3 : 3,
+}
+
+GSM_MI_TYPE_NONE = 0x00
+GSM_MI_TYPE_IMSI = 0x01
+GSM_MI_TYPE_IMEI = 0x02
+GSM_MI_TYPE_IMEISV = 0x03
+GSM_MI_TYPE_TMSI = 0x04
+
+GSM48_IE_MOBILE_ID = 0x17
+
+# Allowed Mobile Identity value lengths by type (3GPP TS 24.008,
+# 10.5.1.4), anything else is a malformed frame
+MI_LENGTHS = {
+	GSM_MI_TYPE_NONE : (1, 3),
+	GSM_MI_TYPE_IMSI : (1, 8),
+	GSM_MI_TYPE_IMEI : (8, 8),
+	GSM_MI_TYPE_IMEISV : (9, 9),
+	GSM_MI_TYPE_TMSI : (5, 5),
+}
+
+# Paging Request layouts (3GPP TS 44.018, 9.1.22 - 9.1.24):
+# mandatory part, as (kind, IEI), the rest octets follow
+IE_TMSI = 0	# V, TMSI/P-TMSI value
+IE_MI = 1	# LV, Mobile Identity
+IE_MI_OPT = 2	# TLV, optional Mobile Identity
+
+PAGING_LAYOUTS = {
+	GSM48_MT_RR_PAG_REQ_1 : ((IE_MI, None),
+		(IE_MI_OPT, GSM48_IE_MOBILE_ID)),
+	GSM48_MT_RR_PAG_REQ_2 : ((IE_TMSI, None), (IE_TMSI, None),
+		(IE_MI_OPT, GSM48_IE_MOBILE_ID)),
+	GSM48_MT_RR_PAG_REQ_3 : ((IE_TMSI, None), (IE_TMSI, None),
+		(IE_TMSI, None), (IE_TMSI, None)),
+}
+
+# Pseudo length, PD, message type and page mode
+PAGING_HDR_LEN = 4
+
+# Shortest valid L2 pseudo length for every message type
+PAGING_MIN_LEN = {
+	GSM48_MT_RR_PAG_REQ_1 : 3 + 2,
+	GSM48_MT_RR_PAG_REQ_2 : 3 + 8,
+	GSM48_MT_RR_PAG_REQ_3 : 3 + 16,
+}
+
+# Precompiled L3 layouts, every one is unpacked at once
+# (mostly) straight from the receive buffer
+
+# msg_len, pd, msg_type
+L3_HDR = struct.Struct("BBB")
+TMSI = struct.Struct(">I")
+
+# msg_len, mi1_len, mi1_type, tmsi1, mi2_iei, mi2_len, mi2_type, tmsi2
+P1_TMSI_LAYOUT = struct.Struct(">B3xBBIBBBI")
+# mi2_iei, mi2_len, mi2_type, tmsi2
+P1_MI2_LAYOUT = struct.Struct(">BBBI")
+# msg_len, tmsi1, tmsi2, mi3_iei, mi3_len, mi3_type, tmsi3
+P2_LAYOUT = struct.Struct(">B3xIIBBBI")
+# msg_len, tmsi1, tmsi2, tmsi3, tmsi4
+P3_LAYOUT = struct.Struct(">B3xIIII")
+
+def pseudo_length(msg_len):
+	# Returns the end of the mandatory part (counting from
+	# the pseudo length itself), or None if it's malformed
+	if msg_len & 0x03 != 0x01:
+		return None
+
+	end = (msg_len >> 2) + 1
+	if end > GSM_MACBLOCK_LEN:
+		return None
+
+	return end
+
+def mi_valid(mi_type, mi_len):
+	limits = MI_LENGTHS.get(mi_type & 0x07)
+	return limits is not None and limits[0] <= mi_len <= limits[1]
+
+def p1_tmsis(buf, offset):
+	# This can contain two MIs
+	msg_len, mi_len, mi_type, tmsi1, iei, mi2_len, mi2_type, tmsi2 = \
+		P1_TMSI_LAYOUT.unpack_from(buf, offset)
+
+	end = pseudo_length(msg_len)
+	next_mi_index = PAGING_HDR_LEN + 1 + mi_len
+	if end is None or next_mi_index > end or not mi_valid(mi_type, mi_len):
+		return ()
+
+	if mi_type & 0x07 == GSM_MI_TYPE_TMSI:
+		tmsis = (tmsi1, )
+	else:
+		# IMSI, IMEI, IMEISV or nothing at all
+		tmsis = ()
+		if next_mi_index != 10:
+			iei, mi2_len, mi2_type, tmsi2 = \
+				P1_MI2_LAYOUT.unpack_from(buf, offset + next_mi_index)
+
+	# Check if there is an additional MI
+	if next_mi_index < end:
+		if iei != GSM48_IE_MOBILE_ID or next_mi_index + 2 + mi2_len != end \
+		  or not mi_valid(mi2_type, mi2_len):
+			return ()
+		if mi2_type & 0x07 == GSM_MI_TYPE_TMSI:
+			return tmsis + (tmsi2, )
+
+	return tmsis
+
+def p2_tmsis(buf, offset):
+	# This can contain two TMSIs and (optionally) one more MI
+	msg_len, tmsi1, tmsi2, iei, mi_len, mi_type, tmsi3 = \
+		P2_LAYOUT.unpack_from(buf, offset)
+
+	end = pseudo_length(msg_len)
+	if end is None or end < 12:
+		return ()
+
+	# Check for optional MI
+	if end > 12:
+		if iei != GSM48_IE_MOBILE_ID or 14 + mi_len != end \
+		  or not mi_valid(mi_type, mi_len):
+			return ()
+		if mi_type & 0x07 == GSM_MI_TYPE_TMSI:
+			return (tmsi1, tmsi2, tmsi3)
+
+	return (tmsi1, tmsi2)
+
+def p3_tmsis(buf, offset):
+	# This one contains four TMSIs
+	msg_len, tmsi1, tmsi2, tmsi3, tmsi4 = P3_LAYOUT.unpack_from(buf, offset)
+	if pseudo_length(msg_len) != 20:
+		return ()
+
+	return (tmsi1, tmsi2, tmsi3, tmsi4)
+
+PAGING_HANDLERS = {
+	GSM48_MT_RR_PAG_REQ_1 : p1_tmsis,
+	GSM48_MT_RR_PAG_REQ_2 : p2_tmsis,
+	GSM48_MT_RR_PAG_REQ_3 : p3_tmsis,
+}
+
+def paging_tmsis(buf, offset=0):
+	# Returns a tuple of TMSIs from a Paging Request (if it's one),
+	# the L3 message is read in place starting from a given offset
+	if offset is None or len(buf) - offset < GSM_MACBLOCK_LEN:
+		return ()
+
+	msg_len, pd, msg_type = L3_HDR.unpack_from(buf, offset)
+	if pd != GSM48_PDISC_RR:
+		return ()
+
+	handler = PAGING_HANDLERS.get(msg_type)
+	if handler is None:
+		return ()
+
+	return handler(buf, offset)
+
+# GSMTAP prefix and L3 header at once, assuming the usual
+# header length of GSMTAP_HDR.size (speculative fast path)
+GSMTAP_L3_HDR = struct.Struct("BBB%dxBBB" % (GSMTAP_HDR.size - 3))
+
+def gsmtap_paging_tmsis(buf):
+	# Returns a tuple of TMSIs from a GSMTAP Um datagram
+	if len(buf) < GSMTAP_HDR.size + GSM_MACBLOCK_LEN:
+		return ()
+
+	version, hdr_len, gsmtap_type, msg_len, pd, msg_type = \
+		GSMTAP_L3_HDR.unpack_from(buf)
+	if version != GSMTAP_VERSION or gsmtap_type != GSMTAP_TYPE_UM:
+		return ()
+
+	# Slow path for unusual header lengths
+	if hdr_len << 2 != GSMTAP_HDR.size:
+		return paging_tmsis(buf, gsmtap_l3_offset(buf))
+
+	if pd != GSM48_PDISC_RR:
+		return ()
+
+	handler = PAGING_HANDLERS.get(msg_type)
+	if handler is None:
+		return ()
+
+	return handler(buf, GSMTAP_HDR.size)
+
+def decode_mi_digits(mi):
+	# BCD digits of IMSI/IMEI/IMEISV, or None if malformed
+	digits = [mi[0] >> 4]
+	for octet in mi[1:]:
+		digits += [octet & 0x0f, octet >> 4]
+
+	# Even number of digits ends with a filler
+	if not mi[0] & 0x08:
+		if digits[-1] != 0x0f:
+			return None
+		digits.pop()
+
+	if not digits or max(digits) > 9:
+		return None
+
+	return "".join(str(x) for x in digits)
+
+def decode_mi_tmsi(mi):
+	return TMSI.unpack_from(mi, 1)[0]
+
+def decode_mi_none(mi):
+	return None
+
+# Mobile Identity value decoders by type
+MI_DECODERS = {
+	GSM_MI_TYPE_NONE : decode_mi_none,
+	GSM_MI_TYPE_IMSI : decode_mi_digits,
+	GSM_MI_TYPE_IMEI : decode_mi_digits,
+	GSM_MI_TYPE_IMEISV : decode_mi_digits,
+	GSM_MI_TYPE_TMSI : decode_mi_tmsi,
+}
+
+def decode_mi(mi):
+	# Returns (mi_type, value), or None if malformed
+	if not mi or not mi_valid(mi[0], len(mi)):
+		return None
+
+	# Bad digits don't break the layout, so the value
+	# is None then, just like for no identity
+	mi_type = mi[0] & 0x07
+	return (mi_type, MI_DECODERS[mi_type](mi))
+
+def paging_request(buf, offset=0):
+	# Fully decodes a Paging Request, walking its layout and checking
+	# every length against the L2 pseudo length. Returns a tuple of
+	# (msg_type, page_mode, [(mi_type, value), ...], rest_octets),
+	# or None if it isn't a (well-formed) Paging Request.
+	if offset is None or len(buf) - offset < GSM_MACBLOCK_LEN:
+		return None
+
+	msg = bytearray(buf[offset:offset + GSM_MACBLOCK_LEN])
+	msg_type = msg[2]
+	layout = PAGING_LAYOUTS.get(msg_type)
+	if msg[1] != GSM48_PDISC_RR or layout is None:
+		return None
+
+	end = pseudo_length(msg[0])
+	if end is None or end - 1 < PAGING_MIN_LEN[msg_type]:
+		return None
+
+	identities = []
+	pos = PAGING_HDR_LEN
+	for kind, iei in layout:
+		if kind == IE_TMSI:
+			mi = bytearray([GSM_MI_TYPE_TMSI | 0xf0]) + msg[pos:pos + 4]
+			pos += 4
+		else:
+			if kind == IE_MI_OPT:
+				if pos == end:
+					break
+				if msg[pos] != iei:
+					return None
+				pos += 1
+
+			if pos >= end:
+				return None
+			mi_len = msg[pos]
+			mi = msg[pos + 1:pos + 1 + mi_len]
+			pos += 1 + mi_len
+
+		if pos > end:
+			return None
+
+		mi = decode_mi(mi)
+		if mi is None:
+			return None
+		identities.append(mi)
+
+	# Nothing but the rest octets after the mandatory part
+	if pos != end:
+		return None
+
+	return (msg_type, msg[3] & 0x03, identities, msg[end:])
+
+def gsmtap_paging_summary(buf):
+	# Returns Paging Request type, number of IMSIs and a tuple
+	# of TMSIs (as gsmtap_paging_tmsis() does, but fully decoded),
+	# or (None, 0, ()) if a given datagram isn't a paging
+	request = paging_request(buf, gsmtap_l3_offset(buf))
+	if request is None:
+		return (None, 0, ())
+
+	imsis = sum(1 for mi_type, value in request[2]
+		if mi_type == GSM_MI_TYPE_IMSI)
+	tmsis = tuple(value for mi_type, value in request[2]
+		if mi_type == GSM_MI_TYPE_TMSI)
+	return (request[0], imsis, tmsis)
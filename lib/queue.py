@@ -23,30 +23,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-class Queue:
+from tmsiset import *
+
+# Compatibility shim for the old list-based API,
+# new code should use TMSISet directly
+class Queue(TMSISet):
 	def __init__(self, a = False, b = False):
-		self.items = []
+		TMSISet.__init__(self)
 
 		if a != False and b != False:
-			for item in a.items:
-				if item in b.items:
-					self.add(item)
+			self.tmsis = a.tmsis & b.tmsis
 
 	def add(self, item):
-		self.items.append(item)
+		TMSISet.add(self, tmsi_to_int(item))
 
 	def find(self, item):
-		return item in self.items
+		return tmsi_to_int(item) in self.tmsis
 
 	def unique(self):
-		unique_items = []
-
-		for item in self.items:
-			if not item in unique_items:
-				unique_items.append(item)
-
-		self.items = unique_items
+		# Sets have no duplicates
+		pass
 
 	def remove(self, item):
-		while item in self.items:
-			self.items.remove(item)
+		self.discard(tmsi_to_int(item))
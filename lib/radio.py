@@ -26,23 +26,134 @@
 import pmt
 import time
 import grgsm
+import threading
 import osmosdr
 
 from math import pi
+from bandplan import *
 from log import *
 
 from gnuradio.eng_option import eng_option
 from gnuradio import eng_notation
 from gnuradio.filter import firdes
+from gnuradio import filter
 from gnuradio import blocks
 from gnuradio import gr
 
+class CtrlCache(gr.basic_block):
+	# Remembers the last clock_offset_control correction per carrier,
+	# so coming back to a known carrier doesn't start from scratch
+	settle_time = 0.5
+
+	def __init__(self):
+		gr.basic_block.__init__(self, name = "ctrl_cache",
+			in_sig = None, out_sig = None)
+
+		self.message_port_register_in(pmt.intern("ctrl_in"))
+		self.message_port_register_out(pmt.intern("ctrl_out"))
+		self.set_msg_handler(pmt.intern("ctrl_in"), self.handle_ctrl)
+
+		# Called from the scheduler threads
+		self.lock = threading.Lock()
+		self.cache = {}
+		self.fc = None
+		self.tune_time = 0
+
+	def handle_ctrl(self, msg):
+		with self.lock:
+			# Corrections for the previous carrier may still come
+			if time.time() - self.tune_time < self.settle_time:
+				return
+			if self.fc is not None:
+				self.cache[self.fc] = msg
+
+	def retune(self, fc):
+		# Returns True if known corrections were reapplied
+		with self.lock:
+			self.fc = fc
+			self.tune_time = time.time()
+			msg = self.cache.get(fc)
+
+		if msg is None:
+			return False
+
+		self.message_port_pub(pmt.intern("ctrl_out"), msg)
+		return True
+
+	def connect(self, tb, clck_ctrl, gsm_input):
+		tb.msg_connect((clck_ctrl, 'ctrl'), (self, 'ctrl_in'))
+		tb.msg_connect((self, 'ctrl_out'), (gsm_input, 'ctrl_in'))
+
+class Channel:
+	# One carrier cut out of a wideband capture:
+	# freq_xlating -> gsm_input -> receiver -> demapper -> decoder
+	def __init__(self, tb, fc, center, taps, decim):
+		self.fc = fc
+		samp_rate = tb.samp_rate / decim
+
+		self.xlating = filter.freq_xlating_fir_filter_ccf(
+			decim, taps, fc - center, tb.samp_rate)
+
+		self.gsm_input = grgsm.gsm_input(
+			ppm = tb.ppm, osr = 4, fc = fc,
+			samp_rate_in = samp_rate)
+
+		self.gsm_clck_ctrl = grgsm.clock_offset_control(
+			fc, samp_rate, osr = 4)
+
+		# Carriers are told apart by ARFCN in GSMTAP headers
+		self.gsm_receiver = grgsm.receiver(4, ([gsmtap_arfcn(fc)]), ([]))
+		self.gsm_bcch_ccch_demapper = grgsm.gsm_bcch_ccch_demapper(
+			timeslot_nr = 0)
+		self.gsm_ccch_decoder = grgsm.control_channels_decoder()
+
+		# GNU Radio runs every block in its own thread,
+		# so carriers are decoded on all available cores
+		tb.connect((tb.source, 0), (self.xlating, 0))
+		tb.connect((self.xlating, 0), (self.gsm_input, 0))
+		tb.connect((self.gsm_input, 0), (self.gsm_receiver, 0))
+
+		tb.msg_connect((self.gsm_receiver, 'C0'),
+			(self.gsm_bcch_ccch_demapper, 'bursts'))
+
+		tb.msg_connect((self.gsm_receiver, 'measurements'),
+			(self.gsm_clck_ctrl, 'measurements'))
+
+		tb.msg_connect((self.gsm_clck_ctrl, 'ctrl'),
+			(self.gsm_input, 'ctrl_in'))
+
+		self.ctrl_cache = CtrlCache()
+		self.ctrl_cache.connect(tb, self.gsm_clck_ctrl, self.gsm_input)
+		self.ctrl_cache.retune(fc)
+
+		tb.msg_connect((self.gsm_bcch_ccch_demapper, 'bursts'),
+			(self.gsm_ccch_decoder, 'bursts'))
+
+		# All carriers share the same TMSI manager
+		tb.msg_connect((self.gsm_ccch_decoder, 'msgs'),
+			(tb.socket_pdu, 'pdus'))
+
+	def set_fc(self, fc, center):
+		self.xlating.set_center_freq(fc - center)
+		self.gsm_input.set_fc(fc)
+		self.gsm_clck_ctrl.set_fc(fc)
+		self.gsm_receiver.set_cell_allocation([gsmtap_arfcn(fc)])
+		self.fc = fc
+
+		return self.ctrl_cache.retune(fc)
+
 class RadioInterface(gr.top_block):
 	fc = 935e6 # ARFCN 0 (initial setup)
 	shiftoff = 400e3
 
+	# Wideband mode specific
+	channel_rate = 400e3
+	channel_width = 200e3
+	usable_band = 0.8
+
 	def __init__(self, phy_device_args, phy_subdev_spec,
-				phy_sample_rate, phy_gain, phy_ppm, sock_port):
+				phy_sample_rate, phy_gain, phy_ppm, sock_port,
+				carriers = None, iq_path = None, iq_fc = None, iq_speed = 0):
 		printl(DGSM, DINFO, "Init Radio interface")
 
 		self.device_args = phy_device_args
@@ -51,26 +162,35 @@ class RadioInterface(gr.top_block):
 		self.gain = phy_gain
 		self.ppm = phy_ppm
 
+		# Several carriers (in Hz) within the sample rate bandwidth
+		self.carriers = None
+		self.channels = None
+
+		# Recorded IQ samples (complex64) instead of PHY,
+		# captured with the center frequency iq_fc (in Hz)
+		self.iq_fc = None
+		if iq_path is not None:
+			self.iq_fc = iq_fc
+			self.fc = iq_fc
+			self.shiftoff = 0
+
 		gr.top_block.__init__(self, "GR-GSM TMSI sniffer")
 		shift_fc = self.fc - self.shiftoff
 
-		##################################################
-		# PHY Definition
-		##################################################
-		self.phy = osmosdr.source(
-			args = "numchan=%d %s" % (1, self.device_args))
+		if carriers is not None:
+			shift_fc = self.wideband_center(carriers)
 
-		self.phy.set_bandwidth(250e3 + abs(self.shiftoff), 0)
-		self.phy.set_center_freq(shift_fc, 0)
-		self.phy.set_sample_rate(self.samp_rate)
-		self.phy.set_freq_corr(self.ppm, 0)
-		self.phy.set_iq_balance_mode(2, 0)
-		self.phy.set_dc_offset_mode(2, 0)
-		self.phy.set_gain_mode(False, 0)
-		self.phy.set_gain(self.gain, 0)
-		self.phy.set_if_gain(20, 0)
-		self.phy.set_bb_gain(20, 0)
-		self.phy.set_antenna("", 0)
+		if iq_path is not None:
+			self.init_file_source(iq_path, iq_speed)
+		else:
+			self.init_phy(shift_fc)
+
+		self.socket_pdu = blocks.socket_pdu(
+			"UDP_CLIENT", "127.0.0.1", str(sock_port), 10000, False)
+
+		if carriers is not None:
+			self.init_wideband(carriers, shift_fc)
+			return
 
 		##################################################
 		# GR-GSM Magic
@@ -85,19 +205,17 @@ class RadioInterface(gr.top_block):
 			ppm = self.ppm, osr = 4, fc = self.fc,
 			samp_rate_in = self.samp_rate)
 
-		self.socket_pdu = blocks.socket_pdu(
-			"UDP_CLIENT", "127.0.0.1", str(sock_port), 10000, False)
-
 		self.gsm_clck_ctrl = grgsm.clock_offset_control(
 			shift_fc, self.samp_rate, osr = 4)
 
 		self.gsm_ccch_decoder = grgsm.control_channels_decoder()
-		self.gsm_receiver = grgsm.receiver(4, ([0]), ([]))
+		self.gsm_receiver = grgsm.receiver(4,
+			([gsmtap_arfcn(self.fc)]), ([]))
 
 		##################################################
 		# Connections
 		##################################################
-		self.connect((self.phy, 0), (self.blocks_rotator, 0))
+		self.connect((self.source, 0), (self.blocks_rotator, 0))
 		self.connect((self.blocks_rotator, 0), (self.gsm_input, 0))
 		self.connect((self.gsm_input, 0), (self.gsm_receiver, 0))
 
@@ -110,12 +228,112 @@ class RadioInterface(gr.top_block):
 		self.msg_connect((self.gsm_clck_ctrl, 'ctrl'),
 			(self.gsm_input, 'ctrl_in'))
 
+		self.ctrl_cache = CtrlCache()
+		self.ctrl_cache.connect(self, self.gsm_clck_ctrl, self.gsm_input)
+		self.ctrl_cache.retune(self.fc)
+
 		self.msg_connect((self.gsm_bcch_ccch_demapper, 'bursts'),
 			(self.gsm_ccch_decoder, 'bursts'))
 
 		self.msg_connect((self.gsm_ccch_decoder, 'msgs'),
 			(self.socket_pdu, 'pdus'))
 
+	def init_phy(self, shift_fc):
+		##################################################
+		# PHY Definition
+		##################################################
+		self.phy = osmosdr.source(
+			args = "numchan=%d %s" % (1, self.device_args))
+
+		self.phy.set_bandwidth(250e3 + abs(self.shiftoff), 0)
+		self.phy.set_center_freq(shift_fc, 0)
+		self.phy.set_sample_rate(self.samp_rate)
+		self.phy.set_freq_corr(self.ppm, 0)
+		self.phy.set_iq_balance_mode(2, 0)
+		self.phy.set_dc_offset_mode(2, 0)
+		self.phy.set_gain_mode(False, 0)
+		self.phy.set_gain(self.gain, 0)
+		self.phy.set_if_gain(20, 0)
+		self.phy.set_bb_gain(20, 0)
+		self.phy.set_antenna("", 0)
+		self.source = self.phy
+
+	def init_file_source(self, iq_path, iq_speed):
+		printl(DGSM, DINFO, "Reading IQ samples from '%s'" % iq_path)
+		self.phy = None
+
+		self.file_source = blocks.file_source(
+			gr.sizeof_gr_complex, iq_path, False)
+		self.source = self.file_source
+
+		# Speed 0 means as fast as the flowgraph goes
+		if iq_speed:
+			self.throttle = blocks.throttle(
+				gr.sizeof_gr_complex, self.samp_rate * iq_speed, True)
+			self.connect((self.file_source, 0), (self.throttle, 0))
+			self.source = self.throttle
+
+	def wideband_center(self, carriers):
+		# Put the center between the outermost carriers,
+		# away from the DC spike of direct conversion receivers
+		center = (min(carriers) + max(carriers)) / 2.0
+		if min([abs(fc - center) for fc in carriers]) < self.channel_width:
+			# Else the middle of the widest gap between carriers,
+			# the nearest one to the middle on a tie
+			ordered = sorted(carriers)
+			gaps = [(b - a, -abs((a + b) / 2.0 - center), (a + b) / 2.0)
+				for a, b in zip(ordered, ordered[1:])]
+			if len(gaps) > 0 and max(gaps)[0] / 2.0 >= self.channel_width:
+				center = max(gaps)[2]
+			else:
+				# No gap is wide enough, go below all of them
+				center = ordered[0] - self.channel_width
+
+		# Recordings have a fixed center frequency
+		if self.iq_fc is not None:
+			center = self.iq_fc
+
+		# Make sure every carrier fits into the usable band
+		half_band = self.samp_rate * self.usable_band / 2
+		for fc in carriers:
+			if abs(fc - center) + self.channel_width / 2 > half_band:
+				raise Exception("Carrier %d Hz doesn't fit into "
+					"%d Hz of bandwidth" % (fc, self.samp_rate))
+
+		return center
+
+	def init_wideband(self, carriers, center):
+		printl(DGSM, DINFO, "Wideband mode, %d carriers around %d Hz"
+			% (len(carriers), center))
+
+		if self.phy is not None:
+			self.phy.set_bandwidth(self.samp_rate, 0)
+
+		# Shared by all the channels
+		decim = max(1, int(self.samp_rate // self.channel_rate))
+		taps = firdes.low_pass(1, self.samp_rate, 125e3, 50e3,
+			firdes.WIN_HAMMING)
+
+		self.channels = [Channel(self, fc, center, taps, decim)
+			for fc in carriers]
+		self.carriers = list(carriers)
+
+	def set_carriers(self, carriers):
+		# Retune all channels at once, their number is fixed.
+		# Returns True if corrections were known for all of them
+		if len(carriers) != len(self.channels):
+			raise Exception("Expected %d carriers, got %d"
+				% (len(self.channels), len(carriers)))
+
+		center = self.wideband_center(carriers)
+		if self.phy is not None:
+			self.phy.set_center_freq(center, 0)
+		cached = [channel.set_fc(fc, center)
+			for channel, fc in zip(self.channels, carriers)]
+
+		self.carriers = list(carriers)
+		return all(cached)
+
 	def shutdown(self):
 		printl(DGSM, DINFO, "Shutdown Radio interface")
 		self.stop()
@@ -131,16 +349,29 @@ class RadioInterface(gr.top_block):
 		return self.fc
 
 	def set_fc(self, fc):
-		self.phy.set_center_freq(fc - self.shiftoff, 0)
+		# Returns True if known corrections were reapplied
+		if self.channels is not None:
+			return self.set_carriers([fc])
+
+		# Recordings can't be retuned, shift within the band instead
+		if self.phy is None:
+			self.set_shiftoff(fc - self.iq_fc)
+		else:
+			self.phy.set_center_freq(fc - self.shiftoff, 0)
+
 		self.gsm_input.set_fc(fc)
+		self.gsm_receiver.set_cell_allocation([gsmtap_arfcn(fc)])
 		self.fc_set = True
 		self.fc = fc
 
+		return self.ctrl_cache.retune(fc)
+
 	def get_gain(self):
 		return self.gain
 
 	def set_gain(self, gain):
-		self.phy.set_gain(gain, 0)
+		if self.phy is not None:
+			self.phy.set_gain(gain, 0)
 		self.gain = gain
 
 	def get_ppm(self):
@@ -167,7 +398,10 @@ class RadioInterface(gr.top_block):
 	def set_shiftoff(self, shiftoff):
 		self.blocks_rotator.set_phase_inc(
 			-2 * pi * shiftoff / self.samp_rate)
+		self.shiftoff = shiftoff
+
+		if self.phy is None:
+			return
 
 		self.phy.set_bandwidth(250e3 + abs(shiftoff), 0)
 		self.phy.set_center_freq(self.fc - shiftoff, 0)
-		self.shiftoff = shiftoff
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Radio interface in a separate process
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import signal
+import multiprocessing
+
+from log import *
+
+def radio_main(conn, args, log_path):
+	# Shutdown is requested by the parent only
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+	# Forked before the parent started any thread,
+	# so the log writer is our own
+	log_start(log_path)
+
+	try:
+		# Import here, so the parent doesn't need GR-GSM
+		from radio import RadioInterface
+
+		radio = RadioInterface(*args)
+		radio.start()
+	except Exception as e:
+		conn.send((0, False, str(e)))
+		log_stop()
+		return
+
+	conn.send((0, True, None))
+
+	# Serve calls from the parent, replies carry the call's
+	# sequence number, so late ones can be told apart
+	while True:
+		try:
+			seq, method, call_args = conn.recv()
+		except EOFError:
+			# The parent is gone
+			seq, method, call_args = None, "shutdown", ()
+
+		try:
+			result = getattr(radio, method)(*call_args)
+		except Exception as e:
+			conn.send((seq, False, str(e)))
+			continue
+
+		if method == "shutdown":
+			break
+
+		conn.send((seq, True, result))
+
+	log_stop()
+
+class RadioProcess:
+	# Max time to wait for the flowgraph to come up
+	init_timeout = 30.0
+	# Max time to wait for a call result
+	call_timeout = 5.0
+
+	def __init__(self, phy_device_args, phy_subdev_spec,
+				phy_sample_rate, phy_gain, phy_ppm, sock_port,
+				carriers = None, iq_path = None, iq_fc = None, iq_speed = 0,
+				log_path = None):
+		printl(DGSM, DINFO, "Starting Radio interface process")
+
+		# Mirrors RadioInterface, one channel per carrier
+		self.channels = None
+		self.carriers = None
+		if carriers is not None:
+			self.channels = list(carriers)
+			self.carriers = list(carriers)
+
+		args = (phy_device_args, phy_subdev_spec, phy_sample_rate,
+			phy_gain, phy_ppm, sock_port, carriers, iq_path, iq_fc, iq_speed)
+
+		# Decoded frames still go through the UDP PDU socket,
+		# only control calls pass through the pipe
+		self.conn, child_conn = multiprocessing.Pipe()
+		self.proc = multiprocessing.Process(target = radio_main,
+			args = (child_conn, args, log_path))
+		self.proc.daemon = True
+		self.proc.start()
+
+		self.seq = 0
+		self.wait_result(self.init_timeout)
+
+	def wait_result(self, timeout):
+		deadline = time.time() + timeout
+
+		while True:
+			if not self.conn.poll(max(0, deadline - time.time())):
+				raise Exception("Radio interface process doesn't respond")
+
+			# Replies to calls which timed out come late
+			seq, ok, result = self.conn.recv()
+			if seq == self.seq:
+				break
+
+		if not ok:
+			raise Exception(result)
+		return result
+
+	def call(self, method, *args):
+		self.seq += 1
+		self.conn.send((self.seq, method, args))
+		return self.wait_result(self.call_timeout)
+
+	def start(self):
+		# Already running since init
+		pass
+
+	def shutdown(self):
+		printl(DGSM, DINFO, "Shutdown Radio interface process")
+
+		try:
+			self.conn.send((None, "shutdown", ()))
+		except IOError:
+			pass
+
+		self.proc.join(self.call_timeout)
+		if self.proc.is_alive():
+			self.proc.terminate()
+
+	def get_fc(self):
+		return self.call("get_fc")
+
+	def set_fc(self, fc):
+		result = self.call("set_fc", fc)
+		if self.channels is not None:
+			self.channels = [fc]
+			self.carriers = [fc]
+		return result
+
+	def set_carriers(self, carriers):
+		result = self.call("set_carriers", carriers)
+		self.channels = list(carriers)
+		self.carriers = list(carriers)
+		return result
+
+	def set_gain(self, gain):
+		return self.call("set_gain", gain)
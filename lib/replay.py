@@ -0,0 +1,206 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Offline pcap/GSMTAP replay
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import struct
+
+from log import *
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_GSMTAP_UM = 217
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+IPPROTO_UDP = 17
+GSMTAP_UDP_PORT = 4729
+
+# Offset of the network layer for link types we support
+LINK_HDR_LEN = {
+	LINKTYPE_NULL : 4,
+	LINKTYPE_ETHERNET : 14,
+	LINKTYPE_RAW : 0,
+	LINKTYPE_LINUX_SLL : 16,
+	LINKTYPE_IPV4 : 0,
+}
+
+# Offset of the ethertype field for link types having one
+LINK_ETHERTYPE = {
+	LINKTYPE_ETHERNET : 12,
+	LINKTYPE_LINUX_SLL : 14,
+}
+
+PCAP_GLOBAL_HDR = struct.Struct("IHHiIII")
+ETHERTYPE = struct.Struct(">H")
+# dst_port, length
+UDP_HDR = struct.Struct(">2xHH2x")
+
+class PcapReader:
+	def __init__(self, path, udp_port = GSMTAP_UDP_PORT):
+		self.file = open(path, "rb")
+		self.udp_port = udp_port
+
+		hdr = self.file.read(PCAP_GLOBAL_HDR.size)
+		if len(hdr) < PCAP_GLOBAL_HDR.size:
+			raise Exception("File is too short for a pcap capture")
+
+		# Detect byte order and timestamp resolution
+		for endian in ("<", ">"):
+			magic = struct.unpack(endian + "I", hdr[:4])[0]
+			if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+				break
+		else:
+			raise Exception("Unknown pcap magic number")
+
+		self.ts_div = 1e6 if magic == PCAP_MAGIC_US else 1e9
+		self.rec_hdr = struct.Struct(endian + "IIII")
+		self.linktype = struct.unpack(endian + "I", hdr[20:24])[0] & 0xffff
+
+		if self.linktype != LINKTYPE_GSMTAP_UM \
+				and self.linktype not in LINK_HDR_LEN:
+			raise Exception("Unsupported pcap link type %d" % self.linktype)
+
+	def close(self):
+		self.file.close()
+
+	def __iter__(self):
+		while True:
+			hdr = self.file.read(self.rec_hdr.size)
+			if len(hdr) < self.rec_hdr.size:
+				return
+
+			ts_sec, ts_frac, incl_len, orig_len = self.rec_hdr.unpack(hdr)
+			frame = self.file.read(incl_len)
+			if len(frame) < incl_len:
+				return
+
+			data = self.extract(frame)
+			if data is not None:
+				yield ts_sec + ts_frac / self.ts_div, data
+
+	def extract(self, frame):
+		# GSMTAP straight away
+		if self.linktype == LINKTYPE_GSMTAP_UM:
+			return frame
+
+		# Ethernet and Linux cooked captures carry ethertype
+		if self.linktype in LINK_ETHERTYPE:
+			offset = LINK_ETHERTYPE[self.linktype]
+			if len(frame) < offset + 2:
+				return None
+			if ETHERTYPE.unpack_from(frame, offset)[0] != ETHERTYPE_IPV4:
+				return None
+
+		# We only need IPv4
+		offset = LINK_HDR_LEN[self.linktype]
+		if len(frame) < offset + 20 or ord(frame[offset]) >> 4 != 4:
+			return None
+
+		# Let's find UDP header
+		if ord(frame[offset + 9]) != IPPROTO_UDP:
+			return None
+		offset += (ord(frame[offset]) & 0x0f) * 4
+		if len(frame) < offset + UDP_HDR.size:
+			return None
+
+		dst_port, length = UDP_HDR.unpack_from(frame, offset)
+		if self.udp_port and dst_port != self.udp_port:
+			return None
+
+		return frame[offset + UDP_HDR.size : offset + length]
+
+class Replay:
+	# Max datagrams to process per loop iteration
+	batch_size = 256
+
+	def __init__(self, path, speed, handler):
+		printl(DAPP, DINFO, "Replaying '%s' at %s speed"
+			% (path, "max" if not speed else "%gx" % speed))
+
+		self.reader = PcapReader(path)
+		self.frames = iter(self.reader)
+		self.handler = handler
+		self.speed = speed
+
+		self.count = 0
+		self.start_wall = None
+		self.start_ts = None
+
+		self.next_frame()
+
+	def close(self):
+		self.reader.close()
+
+	def next_frame(self):
+		try:
+			self.pending = next(self.frames)
+		except StopIteration:
+			self.pending = None
+
+	def due_time(self, ts):
+		# Wall clock time when a frame should be processed
+		return self.start_wall + (ts - self.start_ts) / self.speed
+
+	def timeout(self):
+		# How long select() may sleep, None if nothing to replay
+		if self.pending is None:
+			return None
+		if not self.speed or self.start_wall is None:
+			return 0
+
+		return max(0, self.due_time(self.pending[0]) - time.time())
+
+	def handle_timer(self):
+		if self.pending is None:
+			return
+
+		if self.start_wall is None:
+			self.start_wall = time.time()
+			self.start_ts = self.pending[0]
+
+		now = time.time()
+		for i in range(self.batch_size):
+			ts, data = self.pending
+			if self.speed and self.due_time(ts) > now:
+				break
+
+			self.handler(data)
+			self.count += 1
+			self.next_frame()
+
+			if self.pending is None:
+				self.finish()
+				break
+
+	def finish(self):
+		elapsed = time.time() - self.start_wall
+		printl(DAPP, DINFO, "Replay complete: %d datagrams in %.3f s"
+			% (self.count, elapsed))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Carrier scanner
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from bandplan import *
+from log import *
+
+class Scanner:
+	# How long to stay on every carrier
+	dwell_time = 2.0
+
+	def __init__(self, radio, tmsi_mgr, freqs, handler, dwell_time = None):
+		printl(DGSM, DINFO, "Scanning %d carriers" % len(freqs))
+
+		self.radio = radio
+		self.tmsi_mgr = tmsi_mgr
+		self.freqs = list(freqs)
+		self.handler = handler
+
+		if dwell_time is not None:
+			self.dwell_time = dwell_time
+
+		# Come back where we were in the end (the only
+		# carrier in wideband mode, see ControlInterface)
+		if radio.channels is not None:
+			self.prev_fc = radio.carriers[0]
+		else:
+			self.prev_fc = radio.get_fc()
+		self.results = []
+		self.index = -1
+		self.deadline = None
+		self.next()
+
+	def next(self):
+		# Carriers which can't be tuned to are reported as failed
+		while True:
+			self.index += 1
+			if self.index == len(self.freqs):
+				self.finish()
+				return
+
+			self.fc = self.freqs[self.index]
+			try:
+				self.radio.set_fc(self.fc)
+				break
+			except Exception as e:
+				printl(DGSM, DERROR, "%s: %s"
+					% (describe_freq(self.fc), str(e)))
+				self.results.append((self.fc, None, None))
+
+		# Count decoded CCCH frames from now on
+		self.latency = None
+		self.tmsi_mgr.retune(self.handle_first_frame)
+		self.rx_count = self.tmsi_mgr.rx_count
+		self.deadline = time.time() + self.dwell_time
+
+	def handle_first_frame(self, latency):
+		self.latency = latency
+
+	def timeout(self):
+		# How long select() may sleep
+		if self.deadline is None:
+			return None
+		return max(0, self.deadline - time.time())
+
+	def handle_timer(self):
+		if self.deadline is None or time.time() < self.deadline:
+			return
+
+		frames = self.tmsi_mgr.rx_count - self.rx_count
+		self.results.append((self.fc, frames / self.dwell_time,
+			self.latency))
+		printl(DGSM, DINFO, "%s: %.1f frames/s" % (describe_freq(self.fc),
+			frames / self.dwell_time))
+
+		self.next()
+
+	def finish(self):
+		self.deadline = None
+		try:
+			self.radio.set_fc(self.prev_fc)
+		except Exception as e:
+			printl(DGSM, DERROR, "Can't return to %s: %s"
+				% (describe_freq(self.prev_fc), str(e)))
+
+		# The busiest carrier first, failed ones last
+		self.results.sort(key = lambda x: (x[1] is None, -(x[1] or 0), x[0]))
+		self.handler(self.results)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Metrics registry
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+class Histogram:
+	# Power of two buckets, in microseconds
+	buckets_num = 24
+
+	def __init__(self):
+		self.buckets = [0] * self.buckets_num
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, value):
+		us = int(value * 1e6)
+		index = min(us.bit_length(), self.buckets_num - 1)
+		self.buckets[index] += 1
+
+		self.count += 1
+		self.total += value
+		if value > self.max:
+			self.max = value
+
+	def dump(self, name):
+		avg = self.total / self.count if self.count else 0.0
+		lines = ["%s count=%d avg=%.1fus max=%.1fus"
+			% (name, self.count, avg * 1e6, self.max * 1e6)]
+
+		for i, count in enumerate(self.buckets):
+			if count:
+				lines.append("%s <%dus %d" % (name, 1 << i, count))
+
+		return lines
+
+class Stats:
+	def __init__(self):
+		self.counters = {}
+		self.histograms = {}
+		self.gauges = {}
+		self.start_time = time.time()
+
+	def inc(self, name, value = 1):
+		self.counters[name] = self.counters.get(name, 0) + value
+
+	def observe(self, name, value):
+		hist = self.histograms.get(name)
+		if hist is None:
+			hist = self.histograms[name] = Histogram()
+		hist.add(value)
+
+	def register_gauge(self, name, func):
+		# Gauges are only evaluated on dump
+		self.gauges[name] = func
+
+	def reset(self):
+		self.counters = {}
+		self.histograms = {}
+		self.start_time = time.time()
+
+	def dump(self):
+		lines = ["uptime %.3f" % (time.time() - self.start_time)]
+
+		for name in sorted(self.counters):
+			lines.append("%s %d" % (name, self.counters[name]))
+		for name in sorted(self.gauges):
+			lines.append("%s %s" % (name, self.gauges[name]()))
+		for name in sorted(self.histograms):
+			lines += self.histograms[name].dump(name)
+
+		return "\n".join(lines) + "\n"
+
+	def dump_file(self, path):
+		with open(path, "w") as f:
+			f.write(self.dump())
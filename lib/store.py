@@ -0,0 +1,190 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Persistent recording store
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import mmap
+import glob
+import array
+import struct
+
+from bisect import bisect_left, bisect_right
+from tmsiset import *
+
+# magic, version, reserved, count
+RECORD_HDR = struct.Struct("<4sHHI")
+RECORD_MAGIC = "TMSI"
+RECORD_VERSION = 1
+
+# Records are stored as sorted little endian uint32 arrays
+TMSI_SIZE = 4
+
+def tmsi_array(data):
+	tmsis = array.array("I")
+	tmsis.fromstring(data)
+	if sys.byteorder != "little":
+		tmsis.byteswap()
+	return tmsis
+
+class MappedRecord:
+	# Number of TMSIs per block of the sparse index
+	block_size = 256
+
+	# In-memory bitmap of (folded) TMSIs, so most lookups
+	# (IDLE outsiders) don't have to decode a block of the
+	# mapping. About 3% false positives at 32 bits per TMSI
+	filter_bits = 32
+
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "rb")
+		self.map = mmap.mmap(self.file.fileno(), 0,
+			access = mmap.ACCESS_READ)
+
+		magic, version, reserved, self.count = \
+			RECORD_HDR.unpack_from(self.map)
+		if magic != RECORD_MAGIC or version != RECORD_VERSION:
+			self.close()
+			raise Exception("Wrong record file '%s'" % path)
+		if len(self.map) < RECORD_HDR.size + self.count * TMSI_SIZE:
+			self.close()
+			raise Exception("Truncated record file '%s'" % path)
+
+		# Sparse index: the first TMSI of every block
+		self.index = []
+		for i in range(0, self.count, self.block_size):
+			offset = RECORD_HDR.size + i * TMSI_SIZE
+			self.index.append(struct.unpack_from("<I", self.map, offset)[0])
+
+		size = 8
+		while size < self.count * self.filter_bits:
+			size <<= 1
+		self.filter_mask = size - 1
+		self.filter = bytearray(size // 8)
+
+		mask = self.filter_mask
+		bits = self.filter
+		for i in range(len(self.index)):
+			for tmsi in self.block(i):
+				bit = (tmsi ^ (tmsi >> 15)) & mask
+				bits[bit >> 3] |= 1 << (bit & 7)
+
+		# Filtered out TMSIs (IDLE mode) until the next save
+		self.removed = set()
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+	def block(self, i):
+		start = RECORD_HDR.size + i * self.block_size * TMSI_SIZE
+		end = min(start + self.block_size * TMSI_SIZE,
+			RECORD_HDR.size + self.count * TMSI_SIZE)
+		return tmsi_array(self.map[start:end])
+
+	def __len__(self):
+		return self.count - len(self.removed)
+
+	def __iter__(self):
+		for i in range(len(self.index)):
+			for tmsi in self.block(i):
+				if tmsi not in self.removed:
+					yield tmsi
+
+	def __contains__(self, tmsi):
+		bit = (tmsi ^ (tmsi >> 15)) & self.filter_mask
+		if not self.filter[bit >> 3] & (1 << (bit & 7)):
+			return False
+		if tmsi in self.removed:
+			return False
+
+		# Find a block, then look inside
+		i = bisect_right(self.index, tmsi) - 1
+		if i < 0:
+			return False
+
+		block = self.block(i)
+		j = bisect_left(block, tmsi)
+		return j < len(block) and block[j] == tmsi
+
+	def discard(self, tmsi):
+		# Most TMSIs are ruled out by the bitmap (inlined)
+		bit = (tmsi ^ (tmsi >> 15)) & self.filter_mask
+		if self.filter[bit >> 3] & (1 << (bit & 7)) and tmsi in self:
+			self.removed.add(tmsi)
+
+	def difference_update(self, tmsis):
+		for tmsi in tmsis:
+			self.discard(tmsi)
+
+	def copy(self):
+		result = TMSISet()
+		result.tmsis = set(self)
+		return result
+
+	def sorted(self):
+		return list(self)
+
+	def memory_usage(self):
+		# Mapped pages are not counted, they belong to page cache
+		return sys.getsizeof(self.index) + sys.getsizeof(self.removed) + \
+			(len(self.index) + len(self.removed)) * sys.getsizeof(0xffffffff) + \
+			sys.getsizeof(self.filter)
+
+class RecordStore:
+	def __init__(self, path):
+		self.path = path
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def record_path(self, index):
+		return os.path.join(self.path, "record-%04d.bin" % index)
+
+	def save(self, index, record):
+		# Write into a temporary file first, so a crash
+		# never leaves a half-written record behind
+		path = self.record_path(index)
+		tmsis = array.array("I", record.sorted())
+		if sys.byteorder != "little":
+			tmsis.byteswap()
+
+		with open(path + ".tmp", "wb") as f:
+			f.write(RECORD_HDR.pack(RECORD_MAGIC,
+				RECORD_VERSION, 0, len(tmsis)))
+			tmsis.tofile(f)
+
+		os.rename(path + ".tmp", path)
+		return MappedRecord(path)
+
+	def paths(self):
+		return sorted(glob.glob(os.path.join(self.path, "record-*.bin")))
+
+	def load(self):
+		return [MappedRecord(path) for path in self.paths()]
+
+	def clear(self):
+		for path in glob.glob(os.path.join(self.path, "record-*.bin*")):
+			os.remove(path)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Synthetic GSMTAP paging generator
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import struct
+
+from gsmtap import *
+from paging import *
+
+GSMTAP_CHANNEL_CCCH = 0x02
+GSM_MACBLOCK_PADDING = 0x2b
+
+def l3_frame(body):
+	# Prepend L2 pseudo length and pad up to a MAC block
+	frame = bytearray([(len(body) << 2) | 0x01]) + body
+	frame += bytearray([GSM_MACBLOCK_PADDING]) * (GSM_MACBLOCK_LEN - len(frame))
+	return frame
+
+def mi_tmsi(tmsi):
+	return bytearray([0x05, 0xf4]) + bytearray(TMSI.pack(tmsi))
+
+def mi_digits(number, mi_type):
+	# BCD encoded, odd/even flag in the first octet
+	digits = [int(x) for x in number]
+	odd = len(digits) % 2
+	mi = bytearray([(digits[0] << 4) | (odd << 3) | mi_type])
+	digits = digits[1:] + ([] if odd else [0x0f])
+	for i in range(0, len(digits), 2):
+		mi.append((digits[i + 1] << 4) | digits[i])
+
+	return bytearray([len(mi)]) + mi
+
+def mi_imsi(imsi):
+	return mi_digits(imsi, GSM_MI_TYPE_IMSI)
+
+def mi_imei(imei):
+	return mi_digits(imei, GSM_MI_TYPE_IMEI)
+
+def mi_imeisv(imeisv):
+	return mi_digits(imeisv, GSM_MI_TYPE_IMEISV)
+
+def mi_none():
+	return bytearray([0x01, 0xf0 | GSM_MI_TYPE_NONE])
+
+def p1_frame(mi1, tmsi2=None, mi2=None):
+	# The second MI is either a TMSI, or any encoded one
+	body = bytearray([GSM48_PDISC_RR, GSM48_MT_RR_PAG_REQ_1, 0x00]) + mi1
+	if tmsi2 is not None:
+		mi2 = mi_tmsi(tmsi2)
+	if mi2 is not None:
+		body += bytearray([GSM48_IE_MOBILE_ID]) + mi2
+	return l3_frame(body)
+
+def p2_frame(tmsi1, tmsi2, tmsi3=None, mi3=None):
+	body = bytearray([GSM48_PDISC_RR, GSM48_MT_RR_PAG_REQ_2, 0x00])
+	body += bytearray(struct.pack(">II", tmsi1, tmsi2))
+	if tmsi3 is not None:
+		mi3 = mi_tmsi(tmsi3)
+	if mi3 is not None:
+		body += bytearray([GSM48_IE_MOBILE_ID]) + mi3
+	return l3_frame(body)
+
+def p3_frame(tmsi1, tmsi2, tmsi3, tmsi4):
+	body = bytearray([GSM48_PDISC_RR, GSM48_MT_RR_PAG_REQ_3, 0x00])
+	body += bytearray(struct.pack(">IIII", tmsi1, tmsi2, tmsi3, tmsi4))
+	return l3_frame(body)
+
+def gsmtap_frame(l3, fn=0, arfcn=0):
+	hdr = GSMTAP_HDR.pack(GSMTAP_VERSION, GSMTAP_HDR.size // 4,
+		GSMTAP_TYPE_UM, 0, arfcn, 0, 0, fn, GSMTAP_CHANNEL_CCCH, 0, 0, 0)
+	return hdr + str(l3)
+
+def renumber_corpus(corpus, first_fn):
+	# The same datagrams, with frame numbers from first_fn on
+	return [data[:GSMTAP_FN_OFFSET] + GSMTAP_FN.pack(fn_add(first_fn, n)) +
+		data[GSMTAP_FN_OFFSET + GSMTAP_FN.size:]
+		for n, data in enumerate(corpus)]
+
+def random_digits(rand, count):
+	return "".join(str(rand.randint(0, 9)) for i in range(count))
+
+def random_imsi(rand):
+	return random_digits(rand, 15)
+
+def tmsi_population(size, seed=0):
+	rand = random.Random(seed)
+	return [rand.getrandbits(32) for i in range(size)]
+
+def paging_corpus(count, population, seed=0, repeats=1, repeat_gap=8,
+		first_fn=0):
+	# Returns a list of GSMTAP datagrams carrying a mix of P1/P2/P3
+	# pagings for a TMSI population (either a size, or a list).
+	# Every message is repeated a few times, like networks do.
+	# One datagram per frame, so consecutive corpora need
+	# first_fn to continue the frame numbers.
+	rand = random.Random(seed)
+	if isinstance(population, list):
+		tmsis = population
+	else:
+		tmsis = tmsi_population(population, seed)
+	pick = lambda: rand.choice(tmsis)
+
+	corpus = []
+	for i in range(count):
+		kind = rand.randint(0, 4)
+		if kind == 0:
+			l3 = p1_frame(mi_tmsi(pick()))
+		elif kind == 1:
+			l3 = p1_frame(mi_tmsi(pick()), pick())
+		elif kind == 2:
+			l3 = p1_frame(mi_imsi(random_imsi(rand)), pick())
+		elif kind == 3:
+			l3 = p2_frame(pick(), pick(), pick())
+		else:
+			l3 = p3_frame(pick(), pick(), pick(), pick())
+
+		# Schedule repetitions
+		for k in range(repeats):
+			corpus.append((i + k * repeat_gap, i, l3))
+
+	corpus.sort()
+	return [gsmtap_frame(l3, fn_add(first_fn, n))
+		for n, (slot, i, l3) in enumerate(corpus)]
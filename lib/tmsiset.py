@@ -0,0 +1,493 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+# GR-GSM based TMSI sniffer
+# Hashed TMSI set engine
+#
+# Research purposes only
+# Use at your own risk
+#
+# Copyright (C) 2016  Vadim Yanitskiy <axilirator@gmail.com>
+#
+# All Rights Reserved
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import math
+import heapq
+import array
+import struct
+
+from bisect import bisect_left, insort
+
+try:
+	import numpy
+except ImportError:
+	# Optional, see TMSINumPyArray
+	numpy = None
+
+def tmsi_to_int(tmsi):
+	# Already an integer
+	if isinstance(tmsi, (int, long)):
+		return tmsi & 0xffffffff
+
+	# Big endian, 4 octets
+	tmsi = bytearray(tmsi)
+	return (tmsi[0] << 24) | (tmsi[1] << 16) | (tmsi[2] << 8) | tmsi[3]
+
+def int_to_tmsi(tmsi):
+	return bytearray([(tmsi >> 24) & 0xff, (tmsi >> 16) & 0xff,
+		(tmsi >> 8) & 0xff, tmsi & 0xff])
+
+def pack_tmsis(tmsis):
+	# Big endian uint32 array
+	tmsis = array.array("I", tmsis)
+	if sys.byteorder == "little":
+		tmsis.byteswap()
+	return tmsis.tostring()
+
+def unpack_tmsis(data):
+	tmsis = array.array("I")
+	tmsis.fromstring(data[:len(data) - len(data) % 4])
+	if sys.byteorder == "little":
+		tmsis.byteswap()
+	return tmsis
+
+def pack_scores(scores):
+	# Big endian (uint32 TMSI, int32 score in 1/1000) pairs
+	flat = []
+	for tmsi, score in scores:
+		flat += [tmsi, int(round(score * 1000))]
+	return struct.pack(">" + "Ii" * len(scores), *flat)
+
+def unpack_scores(data):
+	count = len(data) // 8
+	flat = struct.unpack_from(">" + "Ii" * count, data)
+	return [(flat[i], flat[i + 1] / 1000.0) for i in range(0, len(flat), 2)]
+
+# NOTE: TMSIs are expected to be integers here, use
+# tmsi_to_int() to convert the octet representation
+class TMSISet:
+	def __init__(self, items = None):
+		# TMSIs are stored as 32-bit integers
+		if items is None:
+			self.tmsis = set()
+		else:
+			self.tmsis = set(tmsi_to_int(x) for x in items)
+
+	def __len__(self):
+		return len(self.tmsis)
+
+	def __iter__(self):
+		return iter(self.tmsis)
+
+	def __contains__(self, tmsi):
+		return tmsi in self.tmsis
+
+	def add(self, tmsi):
+		self.tmsis.add(tmsi)
+
+	def discard(self, tmsi):
+		self.tmsis.discard(tmsi)
+
+	def difference_update(self, tmsis):
+		self.tmsis.difference_update(tmsis)
+
+	def clear(self):
+		self.tmsis.clear()
+
+	def copy(self):
+		result = TMSISet()
+		result.tmsis = self.tmsis.copy()
+		return result
+
+	def intersection(self, other):
+		result = TMSISet()
+		result.tmsis = self.tmsis & other.tmsis
+		return result
+
+	def intersection_update(self, other):
+		if isinstance(other, TMSISet):
+			self.tmsis &= other.tmsis
+		else:
+			# Any container, e.g. a mapped record
+			self.tmsis = set(x for x in self.tmsis if x in other)
+
+	def sorted(self):
+		return sorted(self.tmsis)
+
+	def memory_usage(self):
+		# Approximate, the set itself and int objects
+		return sys.getsizeof(self.tmsis) + \
+			len(self.tmsis) * sys.getsizeof(0xffffffff)
+
+	# Compatibility with the old list-based Queue,
+	# which used to keep TMSIs as 4-byte arrays
+	@property
+	def items(self):
+		return [int_to_tmsi(x) for x in self.sorted()]
+
+def intersect_sorted(a, b):
+	# Common TMSIs of two sorted arrays, as a sorted list
+	if len(a) > len(b):
+		a, b = b, a
+
+	# Lopsided sizes: binary search for every TMSI of the
+	# shorter one, each search starting where the last ended
+	if len(a) * 16 < len(b):
+		result = []
+		lo, end = 0, len(b)
+		for tmsi in a:
+			lo = bisect_left(b, tmsi, lo)
+			if lo == end:
+				break
+			if b[lo] == tmsi:
+				result.append(tmsi)
+		return result
+
+	# Comparable sizes: a temporary hashed merge is
+	# way faster than a merge loop in Python
+	return sorted(set(a).intersection(b))
+
+class TMSIArray:
+	# Compact record backend: a sorted uint32 array, 4 bytes per TMSI.
+	# Meant for finished records, so removed TMSIs are kept aside
+	# and the array is compacted once there are enough of them.
+	def __init__(self, items = None):
+		if items is None:
+			items = []
+		elif not isinstance(items, (TMSIArray, TMSISet)):
+			items = set(tmsi_to_int(x) for x in items)
+		self.array = self.make_array(sorted(items))
+		self.removed = set()
+
+	# Storage specific part, every TMSI list is sorted here
+
+	def make_array(self, tmsis):
+		return array.array("I", tmsis)
+
+	def values(self):
+		return self.array
+
+	def find(self, tmsi):
+		tmsis = self.array
+		i = bisect_left(tmsis, tmsi)
+		return i < len(tmsis) and tmsis[i] == tmsi
+
+	def insert(self, tmsi):
+		insort(self.array, tmsi)
+
+	def intersect(self, a, b):
+		return intersect_sorted(a, b)
+
+	def exclude(self, tmsis, removed):
+		return [x for x in tmsis if x not in removed]
+
+	def array_size(self):
+		return sys.getsizeof(self.array)
+
+	def __len__(self):
+		return len(self.array) - len(self.removed)
+
+	def __iter__(self):
+		if not self.removed:
+			return iter(self.values())
+		removed = self.removed
+		return (x for x in self.values() if x not in removed)
+
+	def __contains__(self, tmsi):
+		return self.find(tmsi) and tmsi not in self.removed
+
+	def add(self, tmsi):
+		if tmsi in self.removed:
+			self.removed.discard(tmsi)
+		elif not self.find(tmsi):
+			self.insert(tmsi)
+
+	def discard(self, tmsi):
+		if tmsi in self:
+			self.removed.add(tmsi)
+			if len(self.removed) * 16 > len(self.array):
+				self.compact()
+
+	def difference_update(self, tmsis):
+		for tmsi in tmsis:
+			self.discard(tmsi)
+
+	def compact(self):
+		if self.removed:
+			self.array = self.make_array(list(self))
+			self.removed = set()
+
+	def clear(self):
+		self.array = self.make_array([])
+		self.removed = set()
+
+	def copy(self):
+		self.compact()
+		result = self.__class__()
+		result.array = self.make_array(self.array)
+		return result
+
+	def intersection(self, other):
+		result = self.copy()
+		result.intersection_update(other)
+		return result
+
+	def intersection_update(self, other):
+		self.compact()
+		if isinstance(other, self.__class__):
+			# The result is small, filter it instead
+			tmsis = self.intersect(self.array, other.array)
+			if other.removed:
+				tmsis = self.exclude(tmsis, other.removed)
+		elif isinstance(other, TMSISet):
+			tmsis = sorted(other.tmsis.intersection(self.values()))
+		else:
+			# Any container, e.g. a mapped record
+			tmsis = [x for x in self.values() if x in other]
+		self.array = self.make_array(tmsis)
+
+	def sorted(self):
+		return list(self)
+
+	def memory_usage(self):
+		return self.array_size() + sys.getsizeof(self.removed) + \
+			len(self.removed) * sys.getsizeof(0xffffffff)
+
+	@property
+	def items(self):
+		return [int_to_tmsi(x) for x in self.sorted()]
+
+class TMSINumPyArray(TMSIArray):
+	# The same, but searches and intersections run in NumPy
+	def __init__(self, items = None):
+		if numpy is None:
+			raise Exception("NumPy is not available")
+		TMSIArray.__init__(self, items)
+
+	def make_array(self, tmsis):
+		if isinstance(tmsis, numpy.ndarray):
+			return tmsis.astype(numpy.uint32, copy = False)
+		return numpy.fromiter(tmsis, numpy.uint32)
+
+	def values(self):
+		# Plain ints, not NumPy scalars
+		return self.array.tolist()
+
+	def find(self, tmsi):
+		tmsis = self.array
+		i = tmsis.searchsorted(tmsi)
+		return i < len(tmsis) and tmsis[i] == tmsi
+
+	def insert(self, tmsi):
+		self.array = numpy.insert(self.array,
+			self.array.searchsorted(tmsi), tmsi)
+
+	def intersect(self, a, b):
+		# Both are sorted, so look up the shorter one
+		# in the longer one instead of sorting both again
+		if len(a) > len(b):
+			a, b = b, a
+		if not len(a):
+			return a
+
+		i = numpy.minimum(b.searchsorted(a), len(b) - 1)
+		return a[b[i] == a]
+
+	def exclude(self, tmsis, removed):
+		# isin() is there since NumPy 1.13, in1d() is gone in 2.4
+		removed = numpy.fromiter(removed, tmsis.dtype, len(removed))
+		return tmsis[numpy.isin(tmsis, removed, invert = True)]
+
+	def difference_update(self, tmsis):
+		# At once, along with those removed before
+		removed = self.removed.union(tmsis)
+		if removed:
+			self.array = self.exclude(self.array, removed)
+			self.removed = set()
+
+	def array_size(self):
+		# Arrays are never changed in place, so
+		# they may be shared with views and copies
+		return self.array.nbytes
+
+	def compact(self):
+		if self.removed:
+			self.array = self.exclude(self.array, self.removed)
+			self.removed = set()
+
+class TMSIRanking:
+	# Counts how many sets contain every TMSI using set levels only:
+	# levels[i] holds TMSIs found in more than i sets, so all updates
+	# are done by set operations instead of per-TMSI counters
+	def __init__(self):
+		self.levels = []
+
+	def __len__(self):
+		return len(self.levels)
+
+	def add(self, tmsis):
+		new = set(tmsis)
+		for i in range(len(self.levels)):
+			# Those already in this level move one level up
+			promoted = self.levels[i] & new
+			self.levels[i] |= new
+			new = promoted
+
+		self.levels.append(new)
+
+	def at_least(self, count):
+		# TMSIs found in (at least) a given number of sets
+		if count < 1 or count > len(self.levels):
+			return set()
+		return self.levels[count - 1]
+
+	def ranked(self):
+		# Returns a list of (tmsi, count), most popular first
+		result = []
+		for i in range(len(self.levels), 0, -1):
+			level = self.levels[i - 1]
+			if i < len(self.levels):
+				level = level - self.levels[i]
+			result += [(tmsi, i) for tmsi in sorted(level)]
+
+		return result
+
+class TMSIScores:
+	# Penalty for being seen in every IDLE window
+	idle_penalty = 1.0
+
+	def __init__(self):
+		# Compact per-TMSI counters, nothing per record
+		self.hits = {}
+		self.rounds = 0
+		self.idle = {}
+		self.idle_windows = 0
+		self.idle_seen = set()
+
+	def add_round(self, record):
+		hits = self.hits
+		for tmsi in record:
+			hits[tmsi] = hits.get(tmsi, 0) + 1
+		self.rounds += 1
+
+	def add_idle(self, tmsi):
+		# Outsiders only matter once we have some rounds
+		if self.rounds:
+			self.idle_seen.add(tmsi)
+
+	def close_idle_window(self):
+		if not self.rounds:
+			return
+
+		idle = self.idle
+		for tmsi in self.idle_seen:
+			idle[tmsi] = idle.get(tmsi, 0) + 1
+		self.idle_seen = set()
+		self.idle_windows += 1
+
+	def ranked(self, limit = None, idle_open = False):
+		# Returns a list of (tmsi, score), best first, where score is
+		# a hit ratio minus a penalty for IDLE window ratio
+		if not self.rounds:
+			return []
+
+		# The open window counts once it saw some IDLE pagings,
+		# an empty one would only weaken the penalty
+		idle_open = idle_open and len(self.idle_seen) > 0
+
+		hit_weight = 1.0 / self.rounds
+		windows = self.idle_windows + (1 if idle_open else 0)
+		result = [(tmsi, hits * hit_weight)
+			for tmsi, hits in self.hits.iteritems()]
+
+		if windows:
+			idle = self.idle
+			seen = self.idle_seen if idle_open else ()
+			idle_weight = self.idle_penalty / windows
+			result = [(tmsi, score - idle_weight *
+				(idle.get(tmsi, 0) + (tmsi in seen)))
+				for tmsi, score in result]
+
+		key = lambda x: (-x[1], x[0])
+		if limit is None:
+			return sorted(result, key = key)
+		return heapq.nsmallest(limit, result, key = key)
+
+# Multiplier for double hashing, TMSIs aren't always random
+BLOOM_MUL = 0x9e3779b97f4a7c15
+
+class BloomFilter:
+	# Compact "seen" set with a known false positive rate for up to
+	# a given number of TMSIs, no false negatives. A plain bitmap of
+	# the whole 32-bit space would take 512 MiB.
+	def __init__(self, capacity, fp_rate):
+		# Optimal number of bits, rounded up to a power of two
+		bits = -capacity * math.log(fp_rate) / (math.log(2) ** 2)
+		self.size = 1 << max(3, int(math.ceil(math.log(bits, 2))))
+		self.mask = self.size - 1
+		self.capacity = capacity
+
+		# Extra bits allow fewer (slow) hash rounds
+		self.hashes = 1
+		while self.expected_fp_rate(capacity) > fp_rate:
+			self.hashes += 1
+		self.rounds = range(self.hashes)
+
+		self.bits = bytearray(self.size // 8)
+		self.count = 0
+
+	def __len__(self):
+		# Number of additions, repeated TMSIs are counted too
+		return self.count
+
+	def add(self, tmsi):
+		bits = self.bits
+		mask = self.mask
+		h = tmsi * BLOOM_MUL
+		pos, step = h >> 32, (h >> 64) | 1
+		for i in self.rounds:
+			bit = pos & mask
+			bits[bit >> 3] |= 1 << (bit & 7)
+			pos += step
+		self.count += 1
+
+	def __contains__(self, tmsi):
+		bits = self.bits
+		mask = self.mask
+		h = tmsi * BLOOM_MUL
+		pos, step = h >> 32, (h >> 64) | 1
+		for i in self.rounds:
+			bit = pos & mask
+			if not bits[bit >> 3] & (1 << (bit & 7)):
+				return False
+			pos += step
+		return True
+
+	def clear(self):
+		self.bits = bytearray(self.size // 8)
+		self.count = 0
+
+	def expected_fp_rate(self, count):
+		return (1.0 - math.exp(-float(self.hashes) *
+			count / self.size)) ** self.hashes
+
+	def false_positive_rate(self):
+		# For the current number of additions
+		return self.expected_fp_rate(self.count)
+
+	def memory_usage(self):
+		return sys.getsizeof(self.bits)
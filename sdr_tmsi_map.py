@@ -24,48 +24,315 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import time
 import getopt
 import signal
+import collections
 
 from lib.network import *
-from lib.radio import *
-from lib.queue import *
+from lib.replay import *
+from lib.gsmtap import *
+from lib.tmsiset import *
+from lib.paging import *
+from lib.stats import *
+from lib.store import *
+from lib.bandplan import *
+from lib.scan import *
 from lib.log import *
 
 class TMSIManager(UDPServer):
-	def __init__(self, local_port):
+	# Max number of candidates in a scored CROSS result
+	rank_limit = 64
+
+	# How long IDLE pagings are kept, so a START given
+	# by frame number or time may still claim them
+	history_frames = int(2.0 * GSM_FRAME_RATE)
+
+	# Networks repeat pagings, so the same TMSI seen again
+	# within this window is the same paging (0 disables)
+	dedup_frames = int(1.0 * GSM_FRAME_RATE)
+
+	# Frames continuing the clock of a previous carrier are
+	# still queued from before retuning, but only for so long
+	# (retuning to the same cell continues it as well)
+	retune_guard = 1.0
+
+	# IDLE filter bounds (bloom mode), per IDLE window
+	outsiders_capacity = 100000
+	outsiders_fp_rate = 0.001
+
+	# Finished record classes, TMSISet for the rest
+	record_classes = {
+		"array" : TMSIArray,
+		"numpy" : TMSINumPyArray,
+	}
+
+	def __init__(self, local_port, rx_batch=None, rx_rcvbuf=None,
+				stats=None, store=None, cross_mode="strict", history=None,
+				dedup=None, idle_filter="exact", record_backend="set"):
 		printl(DMII, DINFO, "Init TMSI Manager")
-		UDPServer.__init__(self, local_port)
+		UDPServer.__init__(self, local_port,
+			rx_batch=rx_batch, rx_rcvbuf=rx_rcvbuf)
+		self.rx_drops_reported = 0
+
+		# Retuning time, until the first frame is decoded
+		self.retune_time = None
+		self.retune_handler = None
+		self.retune_clocks = {}
+
+		# Received datagrams (decoded CCCH frames)
+		self.rx_count = 0
+
+		# Either strict intersection, or scored ranking
+		self.cross_mode = cross_mode
+
+		# Finished records are either kept as hashed sets,
+		# or as compact sorted arrays (searched by NumPy)
+		if record_backend == "numpy" and numpy is None:
+			printl(DMII, DERROR, "NumPy is not available, "
+				"falling back to plain arrays")
+			record_backend = "array"
+		self.record_backend = record_backend
+
+		# Outsiders are either removed from every record at once,
+		# or remembered in a Bloom filter and applied in bulk.
+		# Bloom positives are confirmed by the (few) outsiders
+		# which are still candidates, so none is lost by mistake
+		self.idle_filter = idle_filter
+		self.outsiders = None
+		self.outsider_candidates = set()
+		if idle_filter == "bloom":
+			self.outsiders = BloomFilter(self.outsiders_capacity,
+				self.outsiders_fp_rate)
+			printl(DMII, DINFO, "IDLE filter: %d KiB, %d hashes, "
+				"%.2g false positives for %d TMSIs"
+				% (self.outsiders.memory_usage() // 1024,
+				self.outsiders.hashes, self.outsiders_fp_rate,
+				self.outsiders_capacity))
+
+		# Frame clocks of the carriers, ARFCN -> (FN, time),
+		# and the latest frame (its carrier, FN and time)
+		self.clocks = {}
+		self.arfcn = None
+		self.fn = None
+		self.fn_time = None
+		if history is not None:
+			self.history_frames = int(history * GSM_FRAME_RATE)
+
+		# Recently seen TMSIs, first (ARFCN, FN) of every paging
+		self.recent = {}
+		self.recent_fns = collections.deque()
+		self.dedup_suppressed = 0
+		if dedup is not None:
+			self.dedup_frames = int(dedup * GSM_FRAME_RATE)
+
+		# Don't let the initial flush wipe the store
+		self.records = []
+		self.store = None
 		self.flush()
+		self.store = store
+
+		# Metrics are optional (None means disabled)
+		self.stats = stats
+		if stats is not None:
+			stats.register_gauge("records", lambda: len(self.records))
+			stats.register_gauge("records_tmsis",
+				lambda: sum(len(r) for r in self.records))
+			stats.register_gauge("record_tmsis", lambda: len(self.record))
+			stats.register_gauge("candidates", lambda: 0
+				if self.candidates is None else len(self.candidates))
+			stats.register_gauge("rx_drops", lambda: self.rx_drops)
+			stats.register_gauge("history", lambda: len(self.history))
+			stats.register_gauge("dedup_tmsis", lambda: len(self.recent))
+			stats.register_gauge("dedup_suppressed",
+				lambda: self.dedup_suppressed)
+			if self.outsiders is not None:
+				stats.register_gauge("outsiders_fp_rate",
+					lambda: self.outsiders.false_positive_rate())
 
 	def shutdown(self):
 		printl(DMII, DINFO, "Shutdown TMSI Manager")
+		if self.dedup_suppressed:
+			printl(DMII, DINFO, "Suppressed %d repeated pagings"
+				% self.dedup_suppressed)
 		self.close()
 
+	def handle_rx_batch(self, batch):
+		handle_rx_data = self.handle_rx_data
+		for data in batch:
+			handle_rx_data(data)
+
+		# Report kernel drops, if any
+		if self.rx_drops and self.rx_drops != self.rx_drops_reported:
+			printl(DMII, DERROR, "Kernel dropped %d datagrams so far"
+				% self.rx_drops)
+			self.rx_drops_reported = self.rx_drops
+
+	def retune(self, handler = None):
+		# Measure time to the first decoded frame,
+		# the handler gets it in seconds
+		self.retune_time = time.time()
+		self.retune_handler = handler
+
+		# Frame numbers of the previous carriers are gone,
+		# but their queued frames still have to be told apart
+		self.retune_clocks = self.clocks
+		self.clocks = {}
+		self.arfcn = None
+
+	def handle_first_frame(self, data):
+		if gsmtap_l3_offset(data) is None:
+			return
+
+		# Queued frames of a previous carrier continue its clock
+		now = time.time()
+		if now - self.retune_time < self.retune_guard:
+			arfcn, fn = gsmtap_clock(data)
+			clock = self.retune_clocks.get(arfcn)
+			if clock is not None:
+				cfn, ctime = clock
+				if 0 <= fn_diff(fn, cfn) <= (now - ctime +
+						self.retune_guard) * GSM_FRAME_RATE:
+					return
+
+		latency = now - self.retune_time
+		self.retune_time = None
+		self.retune_clocks = {}
+
+		printl(DMII, DINFO, "First frame %.3f s after retuning" % latency)
+		if self.stats is not None:
+			self.stats.observe("retune_time", latency)
+
+		if self.retune_handler is not None:
+			self.retune_handler(latency)
+
 	def handle_rx_data(self, data):
-		# Convert to a byte array
-		data = bytearray(data)
-		# Cut GSMTAP header
-		l3 = data[16:]
-
-		# We need Paging Requests only
-		if l3[1] == 0x06:
-			if l3[2] == 0x21:
-				self.handle_p1(l3)
-			elif l3[2] == 0x22:
-				self.handle_p2(l3)
-			elif l3[2] == 0x24:
-				self.handle_p3(l3)
+		# Counted here, datagrams don't always come in batches
+		self.rx_count += 1
+		if self.retune_time is not None:
+			self.handle_first_frame(data)
+
+		if self.stats is not None:
+			self.handle_rx_data_stats(data)
+			return
+
+		# We need Paging Requests only (decoded in place)
+		tmsis = gsmtap_paging_tmsis(data)
+		if tmsis:
+			self.handle_fn(*gsmtap_clock(data))
+			for tmsi in tmsis:
+				self.handle_tmsi(tmsi)
+
+	def handle_rx_data_stats(self, data):
+		start = time.time()
+		stats = self.stats
+
+		stats.inc("rx_datagrams")
+
+		# Decoded once, the counters come along
+		msg_type, imsis, tmsis = gsmtap_paging_summary(data)
+		if msg_type is not None:
+			stats.inc("paging_p%d" % PAGING_TYPES[msg_type])
+			stats.inc("imsis", imsis)
+
+		stats.inc("tmsis", len(tmsis))
+		if tmsis:
+			self.handle_fn(*gsmtap_clock(data))
+			for tmsi in tmsis:
+				self.handle_tmsi(tmsi)
+
+		stats.observe("rx_process_time", time.time() - start)
 
 	def print_tmsi(self, tmsi):
-		msg = "Paging Request to 0x"
-		for x in tmsi:
-			msg += "{:02x}".format(x)
-
+		# Formatting is deferred to the log writer
 		cat = DMIR if self.recording else DMII
-		printl(cat, DPAGING, msg)
+		printl(cat, DPAGING, "Paging Request to 0x%08x", tmsi)
+
+	def handle_fn(self, arfcn, fn):
+		# Cells aren't synchronized, so a frame number
+		# only makes sense together with its carrier
+		now = time.time()
+		self.arfcn = arfcn
+		self.fn = fn
+		self.fn_time = now
+		self.clocks[arfcn] = (fn, now)
+
+		# Scheduled window edges, by the carrier's own clock
+		pending = self.pending_start
+		if pending is not None and arfcn in pending and \
+				fn_diff(fn, pending[arfcn]) >= 0:
+			self.open_record(pending)
+		pending = self.pending_stop
+		if pending is not None and arfcn in pending and \
+				fn_diff(fn, pending[arfcn]) >= 0:
+			self.close_record(pending)
+
+	def frames_since(self, arfcn, fn):
+		# Frames passed on a carrier since the given FN,
+		# clocks of the others run on until the latest frame
+		if arfcn == self.arfcn:
+			return fn_diff(self.fn, fn)
+
+		clock = self.clocks.get(arfcn)
+		if clock is None:
+			# Not tuned to that carrier anymore
+			return GSM_HYPERFRAME
+
+		cfn, ctime = clock
+		return fn_diff(cfn, fn) + \
+			int((self.fn_time - ctime) * GSM_FRAME_RATE)
+
+	def fn_at(self, arfcn, t):
+		# Frame number of a carrier at a given time
+		cfn, ctime = self.clocks[arfcn]
+		return fn_add(cfn, int(round((t - ctime) * GSM_FRAME_RATE)))
+
+	def fn_bounds(self, fn):
+		# Window edge by frame number, which belongs to a single
+		# carrier. None if no carrier is known yet (meaning now)
+		if len(self.clocks) > 1:
+			raise Exception("Frame number is ambiguous with %d carriers, "
+				"give the time instead" % len(self.clocks))
+		return dict((arfcn, fn) for arfcn in self.clocks) or None
+
+	def time_bounds(self, t):
+		# Window edge by time, as a frame number of every
+		# carrier. None if no carrier is known yet (meaning now)
+		return dict((arfcn, self.fn_at(arfcn, t))
+			for arfcn in self.clocks) or None
+
+	def bounds_ahead(self, bounds):
+		# Some carrier didn't reach its window edge yet
+		for arfcn, fn in bounds.iteritems():
+			if self.frames_since(arfcn, fn) < 0:
+				return True
+		return False
 
 	def handle_tmsi(self, tmsi):
+		# Repetitions belong to the window of the first
+		# sighting, so they don't need to go any further
+		arfcn = self.arfcn
+		fn = self.fn
+		if fn is not None and self.dedup_frames:
+			# Frames are counted by the clock of the carrier
+			# it was first seen on (cells repeat it, too)
+			frames_since = self.frames_since
+			recent = self.recent
+			first = recent.get(tmsi)
+			if first is not None and \
+					frames_since(first[0], first[1]) <= self.dedup_frames:
+				self.dedup_suppressed += 1
+				return
+
+			first = (arfcn, fn)
+			recent[tmsi] = first
+			recent_fns = self.recent_fns
+			recent_fns.append((first, tmsi))
+			while frames_since(*recent_fns[0][0]) > self.dedup_frames:
+				efirst, etmsi = recent_fns.popleft()
+				if recent[etmsi] is efirst:
+					del recent[etmsi]
+
 		# Yes, print this one first
 		self.print_tmsi(tmsi)
 
@@ -73,81 +340,269 @@ class TMSIManager(UDPServer):
 		if self.recording:
 			# Add every possible TMSI
 			self.record.add(tmsi)
+			self.record_fns[tmsi] = (arfcn, fn)
+		elif fn is not None and self.history_frames:
+			# Keep it for a while, a START may still claim it
+			history = self.history
+			history.append((arfcn, fn, tmsi))
+			frames_since = self.frames_since
+			while frames_since(history[0][0], history[0][1]) > \
+					self.history_frames:
+				self.handle_outsider(history.popleft()[2])
+		else:
+			self.handle_outsider(tmsi)
+
+	def handle_outsider(self, tmsi):
+		if self.outsiders is not None:
+			# Filtered later, see apply_outsiders()
+			self.outsiders.add(tmsi)
+			if self.candidates is not None and tmsi in self.candidates:
+				self.outsider_candidates.add(tmsi)
 		else:
 			# Filter outsider TMSIs
 			for record in self.records:
-				record.remove(tmsi)
-
-	def handle_p1(self, l3):
-		# This can contain two MIs
-		mi_type = l3[5] & 0x07
-		mi_found = False
-		msg_len = l3[0]
-
-		# FIXME: What about IMEI and IMEISV???
-		if mi_type == 0x04: # TMSI
-			self.handle_tmsi(l3[6:10])
-			next_mi_index = 10
-			mi_found = True
-		elif mi_type == 0x01: # IMSI
-			next_mi_index = 13
-			mi_found = True
-
-		# Check if there is an additional MI
-		if mi_found:
-			if next_mi_index < (msg_len + 1) and l3[next_mi_index] == 0x17:
-				# Extract MI type and length
-				mi_type = l3[next_mi_index + 2] & 0x07
-				mi2_len = l3[next_mi_index + 1]
-
-				# We only need TMSI
-				if mi_type == 0x04:
-					a = next_mi_index + 3
-					b = next_mi_index + 7
-					self.handle_tmsi(l3[a:b])
-
-	def handle_p2(self, l3):
-		# This can contain two TMSIs and (optionally) one more MI
-		self.handle_tmsi(l3[4:8])
-		self.handle_tmsi(l3[8:12])
-		
-		# Check for optional TMSI
-		if l3[14] & 0x07 == 0x04:
-			self.handle_tmsi(l3[15:19])
-
-	def handle_p3(self, l3):
-		# This one contains four TMSIs
-		self.handle_tmsi(l3[4:8])
-		self.handle_tmsi(l3[8:12])
-		self.handle_tmsi(l3[12:16])
-		self.handle_tmsi(l3[16:20])
-
-	def start(self):
-		self.record = Queue()
+				record.discard(tmsi)
+
+			# Keep the running intersection up to date
+			if self.candidates is not None:
+				self.candidates.discard(tmsi)
+
+		# Penalize outsiders in scored mode
+		if self.scores is not None:
+			self.scores.add_idle(tmsi)
+
+	def start(self, bounds = None):
+		# Either now, or from given frame numbers (see
+		# fn_bounds()), which may also be in the (recent) past
+		if bounds is not None and self.bounds_ahead(bounds):
+			self.pending_start = bounds
+			return
+
+		self.open_record(bounds)
+
+	def stop(self, bounds = None):
+		# A round must not be counted twice
+		if not self.recording and self.pending_start is None:
+			printl(DMII, DERROR, "Not recording, STOP ignored")
+			return
+
+		# Either now, or at given frame numbers (see start())
+		if bounds is not None and self.bounds_ahead(bounds):
+			self.pending_stop = bounds
+			return
+
+		if self.pending_start is not None:
+			printl(DMII, DERROR, "Recording didn't start yet, cancelled")
+			self.pending_start = None
+			return
+
+		self.close_record(bounds)
+
+	def open_record(self, bounds = None):
+		self.pending_start = None
+
+		# Records left by a previous run, which weren't loaded,
+		# would be partly overwritten and mixed with new ones
+		if not self.records and self.store is not None and \
+				self.store.paths():
+			printl(DMII, DERROR, "Starting a new campaign, "
+				"dropping unloaded records from the store")
+			self.store.clear()
+
+		if bounds is not None and [arfcn for arfcn, fn in bounds.iteritems()
+				if self.frames_since(arfcn, fn) > self.history_frames]:
+			printl(DMII, DERROR, "Recording starts beyond the history, "
+				"some pagings may be lost")
+
+		# Claim recent IDLE pagings since the start
+		claimed = []
+		for entry in self.history:
+			harfcn, hfn, tmsi = entry
+			if bounds is not None and harfcn in bounds and \
+					fn_diff(hfn, bounds[harfcn]) >= 0:
+				claimed.append(entry)
+			else:
+				self.handle_outsider(tmsi)
+		self.history.clear()
+		self.apply_outsiders()
+
+		if self.scores is not None:
+			self.scores.close_idle_window()
+
+		self.record = TMSISet()
+		self.record_fns = {}
 		self.recording = True
 
-	def stop(self):
-		self.record.unique() # We don't need any duplicates
+		for harfcn, hfn, tmsi in claimed:
+			self.record.add(tmsi)
+			self.record_fns[tmsi] = (harfcn, hfn)
+
+	def close_record(self, bounds = None):
+		self.pending_stop = None
+		if not self.recording:
+			return
+
+		# Those seen after the end are outsiders, but
+		# keep them in the history for the next START
+		late = []
+		if bounds is not None:
+			late = [(tarfcn, tfn, tmsi) for tmsi, (tarfcn, tfn)
+				in self.record_fns.iteritems()
+				if tarfcn in bounds and fn_diff(tfn, bounds[tarfcn]) > 0]
+			late.sort(key = lambda x: -self.frames_since(x[0], x[1]))
+			for tarfcn, tfn, tmsi in late:
+				self.record.discard(tmsi)
+		self.record_fns = {}
+
+		# Nothing is added to a finished record
+		record_class = self.record_classes.get(self.record_backend)
+		if record_class is not None:
+			self.record = record_class(self.record)
+
 		self.records.append(self.record)
 		self.recording = False
 
+		# Narrow down the running intersection
+		if self.candidates is None:
+			self.candidates = self.record.copy()
+		else:
+			self.candidates.intersection_update(self.record)
+
+		# Count hits for the scored ranking
+		if self.scores is not None:
+			self.scores.add_round(self.record)
+
+		# Persist this record, and keep it memory-mapped
+		if self.store is not None:
+			index = len(self.records) - 1
+			self.records[index] = self.store.save(index, self.record)
+
+		self.history.extend(late)
+
+	def apply_outsiders(self):
+		# Filter the IDLE window so far (bloom mode) out of the running
+		# intersection. Other TMSIs aren't part of it anyway, so the
+		# records only lose the same few, and are never walked
+		outsiders = self.outsiders
+		if outsiders is None or not len(outsiders):
+			return
+
+		if self.candidates is not None:
+			confirmed = [x for x in self.candidates
+				if x in outsiders and x in self.outsider_candidates]
+			self.candidates.difference_update(confirmed)
+			for record in self.records:
+				record.difference_update(confirmed)
+
+		outsiders.clear()
+		self.outsider_candidates.clear()
+
 	def flush(self):
+		self.close_records()
 		self.records = []
-		self.record = Queue()
+		self.record = TMSISet()
+		self.candidates = None
 		self.recording = False
+		self.record_fns = {}
+		self.history = collections.deque()
+		self.recent.clear()
+		self.recent_fns.clear()
+		if self.outsiders is not None:
+			self.outsiders.clear()
+		self.outsider_candidates.clear()
+		self.pending_start = None
+		self.pending_stop = None
+
+		self.scores = None
+		if self.cross_mode == "score":
+			self.scores = TMSIScores()
+
+		if self.store is not None:
+			self.store.clear()
+
+	def close_records(self):
+		for record in self.records:
+			if isinstance(record, MappedRecord):
+				record.close()
+
+	def save(self):
+		# Rewrite all records, dropping filtered out TMSIs
+		self.apply_outsiders()
+		for index, record in enumerate(self.records):
+			self.records[index] = self.store.save(index, record)
+			if isinstance(record, MappedRecord):
+				record.close()
+
+	def load(self):
+		self.close_records()
+		self.records = self.store.load()
+		self.record = TMSISet()
+		self.recording = False
+		self.record_fns = {}
+		self.history.clear()
+		self.recent.clear()
+		self.recent_fns.clear()
+		if self.outsiders is not None:
+			self.outsiders.clear()
+		self.outsider_candidates.clear()
+		self.pending_start = None
+		self.pending_stop = None
+
+		# Rebuild the running intersection
+		self.candidates = None
+		for record in self.records:
+			if self.candidates is None:
+				self.candidates = record.copy()
+			else:
+				self.candidates.intersection_update(record)
+
+		# Hit counts can be rebuilt, IDLE sightings are already
+		# applied to the records themselves
+		if self.cross_mode == "score":
+			self.scores = TMSIScores()
+			for record in self.records:
+				self.scores.add_round(record)
+
+	def rank(self, limit = None):
+		# Scored candidates, tolerant to missed pagings
+		if self.scores is None:
+			return []
+		return self.scores.ranked(limit, idle_open = not self.recording)
+
+	def discard_history(self, result):
+		# IDLE pagings still in the history are outsiders too
+		result.difference_update([tmsi for arfcn, fn, tmsi in self.history])
+		return result
 
 	def cross(self):
+		self.apply_outsiders()
 		if len(self.records) > 1:
-			result = self.records[0]
+			return self.discard_history(self.candidates.copy())
+		else:
+			return TMSISet()
+
+	def cross_full(self):
+		# Recompute the intersection from scratch
+		self.apply_outsiders()
+		if len(self.records) > 1:
+			result = self.records[0].copy()
 
-			for recod in self.records[1:]:
-				result = Queue(result, recod)
+			for record in self.records[1:]:
+				result.intersection_update(record)
 
-			return result
+			return self.discard_history(result)
 		else:
-			return []
+			return TMSISet()
+
+	def verify_cross(self):
+		# Consistency check for the running intersection
+		return self.cross().sorted() == self.cross_full().sorted()
 
 class ControlInterface(TCPClient):
+	# Times given by the master further off than this
+	# likely mean its clock isn't in sync with ours
+	max_skew = 0.3
+
 	def __init__(self, app):
 		printl(DCTL, DINFO, "Init Control interface")
 		TCPClient.__init__(self)
@@ -182,34 +637,228 @@ class ControlInterface(TCPClient):
 		else:
 			return False
 
+	def report_retune(self, carriers, cached):
+		# Reply once the first frame is decoded on the new carrier(s)
+		def report(latency):
+			self.send("RXTUNE Result: %s, first frame after %.3f s "
+				"(%s corrections)\n" % (", ".join(describe_freq(fc)
+				for fc in carriers), latency, "cached" if cached else "no"))
+
+		self.app.tmsi_mgr.retune(report)
+
+	def fn_bounds(self, fn):
+		# Window edges may be given as a frame number,
+		# raises if there are several carriers
+		bounds = self.app.tmsi_mgr.fn_bounds(int(fn) % GSM_HYPERFRAME)
+		if bounds is None:
+			printl(DCTL, DERROR, "No frame number known yet, using now")
+		return bounds
+
+	def time_bounds(self, ms):
+		# Window edges may be given as UNIX time in ms,
+		# every carrier has its own frame number then
+		t = int(ms) / 1000.0
+		skew = t - time.time()
+		if abs(skew) > self.max_skew:
+			printl(DCTL, DERROR, "UNIX time %s ms is %.3f s off, "
+				"is the clock in sync with the master (NTP)?" % (ms, skew))
+
+		bounds = self.app.tmsi_mgr.time_bounds(t)
+		if bounds is None:
+			printl(DCTL, DERROR, "No frame number known yet, using now")
+		else:
+			printl(DCTL, DINFO, "UNIX time %s ms is %s" % (ms,
+				", ".join("FN %d on ARFCN %d" % (fn, arfcn)
+				for arfcn, fn in sorted(bounds.iteritems()))))
+		return bounds
+
+	def report_scan(self, results):
+		self.app.scanner = None
+
+		data = "SCAN Result (%d carriers):\n" % len(results)
+		for fc, rate, latency in results:
+			if rate is None:
+				data += "%s failed\n" % describe_freq(fc)
+				continue
+
+			data += "%s %.1f frames/s" % (describe_freq(fc), rate)
+			if latency is not None:
+				data += ", first frame after %.3f s" % latency
+			data += "\n"
+
+		self.send(data)
+
 	def parse_cmd(self, request):
-		if self.verify_cmd(request, "RXTUNE", 1):
+		if len(request) > 1 and \
+				self.verify_cmd(request, "RXTUNE", len(request) - 1):
 			printl(DCTL, DINFO, "Recv RXTUNE cmd")
-			freq = int(request[1]) * 1000
+			radio = self.app.radio
+
+			if radio is None:
+				printl(DCTL, DERROR, "Radio interface isn't running")
+				return
+
+			if self.app.scanner is not None:
+				printl(DCTL, DERROR, "Scanning is in progress")
+				return
+
+			# Either ARFCNs, or frequencies in kHz
+			try:
+				carriers = [parse_freq(v) for v in request[1:]]
+			except Exception as e:
+				printl(DCTL, DERROR, str(e))
+				return
+
+			printl(DCTL, DINFO, "Switching to %s"
+				% ", ".join(describe_freq(fc) for fc in carriers))
 
-			printl(DCTL, DINFO, "Switching to %d Hz" % freq)
-			self.app.radio.set_fc(freq)
+			if len(carriers) > 1 and radio.channels is None:
+				printl(DCTL, DERROR, "Radio interface isn't in wideband mode")
+				return
+
+			try:
+				if len(carriers) == 1:
+					cached = radio.set_fc(carriers[0])
+				else:
+					cached = radio.set_carriers(carriers)
+			except Exception as e:
+				printl(DCTL, DERROR, str(e))
+				return
+
+			self.report_retune(carriers, cached)
+
+		elif len(request) > 1 and \
+				self.verify_cmd(request, "SCAN", len(request) - 1):
+			printl(DCTL, DINFO, "Recv SCAN cmd")
+			radio = self.app.radio
+
+			if radio is None:
+				printl(DCTL, DERROR, "Radio interface isn't running")
+				return
+
+			if self.app.scanner is not None:
+				printl(DCTL, DERROR, "Scanning is already in progress")
+				return
+
+			if radio.channels is not None and len(radio.channels) > 1:
+				printl(DCTL, DERROR, "Can't scan with several carriers")
+				return
+
+			try:
+				freqs = [parse_freq(v) for v in request[1:]]
+			except Exception as e:
+				printl(DCTL, DERROR, str(e))
+				return
+
+			try:
+				scanner = Scanner(radio, self.app.tmsi_mgr, freqs,
+					self.report_scan, self.app.scan_dwell)
+			except Exception as e:
+				printl(DCTL, DERROR, str(e))
+				return
+
+			# Already reported if no carrier could be tuned to
+			if scanner.deadline is not None:
+				self.app.scanner = scanner
 
 		elif self.verify_cmd(request, "START", 0):
 			printl(DCTL, DINFO, "Recv START cmd")
 			self.app.tmsi_mgr.start()
 
+		elif self.verify_cmd(request, "START", 1):
+			printl(DCTL, DINFO, "Recv START cmd (FN %s)" % request[1])
+
+			try:
+				bounds = self.fn_bounds(request[1])
+			except Exception as e:
+				printl(DCTL, DERROR, str(e))
+				return
+
+			self.app.tmsi_mgr.start(bounds)
+
+		elif self.verify_cmd(request, "STARTAT", 1):
+			printl(DCTL, DINFO, "Recv STARTAT cmd")
+			self.app.tmsi_mgr.start(self.time_bounds(request[1]))
+
 		elif self.verify_cmd(request, "STOP", 0):
 			printl(DCTL, DINFO, "Recv STOP cmd")
 			self.app.tmsi_mgr.stop()
 
+		elif self.verify_cmd(request, "STOP", 1):
+			printl(DCTL, DINFO, "Recv STOP cmd (FN %s)" % request[1])
+
+			try:
+				bounds = self.fn_bounds(request[1])
+			except Exception as e:
+				printl(DCTL, DERROR, str(e))
+				return
+
+			self.app.tmsi_mgr.stop(bounds)
+
+		elif self.verify_cmd(request, "STOPAT", 1):
+			printl(DCTL, DINFO, "Recv STOPAT cmd")
+			self.app.tmsi_mgr.stop(self.time_bounds(request[1]))
+
 		elif self.verify_cmd(request, "CROSS", 0):
 			printl(DCTL, DINFO, "Recv CROSS cmd")
+			start = time.time()
 
-			result = self.app.tmsi_mgr.cross()
-			response = "CROSS Result:\n"
-			for tmsi in result.items:
-				response += "0x"
-				for x in tmsi:
-					response += "{:02x}".format(x)
-				response += "\n"
+			mgr = self.app.tmsi_mgr
+			if mgr.cross_mode == "score":
+				# Send as packed (TMSI, score) pairs, outsiders
+				# seen as often as paged aren't worth sending
+				result = [(tmsi, score) for tmsi, score
+					in mgr.rank(mgr.rank_limit) if score > 0]
+				self.send(pack_scores(result), FRAME_SCORES)
+			else:
+				# Send as a packed uint32 array
+				result = mgr.cross()
+				self.send(pack_tmsis(result.sorted()), FRAME_TMSIS)
 
-			self.send(response)
+			if self.app.stats is not None:
+				self.app.stats.observe("cross_time", time.time() - start)
+
+		elif self.verify_cmd(request, "STATS", 0):
+			printl(DCTL, DINFO, "Recv STATS cmd")
+
+			if self.app.stats is None:
+				self.send("STATS Result: disabled\n")
+				return
+
+			self.send("STATS Result:\n" + self.app.stats.dump())
+			if self.app.stats_path is not None:
+				self.app.stats.dump_file(self.app.stats_path)
+
+		elif self.verify_cmd(request, "CHECK", 0):
+			printl(DCTL, DINFO, "Recv CHECK cmd")
+
+			if self.app.tmsi_mgr.verify_cross():
+				self.send("CHECK Result: OK\n")
+			else:
+				printl(DCTL, DERROR, "Running intersection is inconsistent")
+				self.send("CHECK Result: MISMATCH\n")
+
+		elif self.verify_cmd(request, "SAVE", 0):
+			printl(DCTL, DINFO, "Recv SAVE cmd")
+
+			if self.app.tmsi_mgr.store is None:
+				printl(DCTL, DERROR, "Recording store isn't configured")
+				return
+
+			self.app.tmsi_mgr.save()
+			printl(DCTL, DINFO, "Saved %d records"
+				% len(self.app.tmsi_mgr.records))
+
+		elif self.verify_cmd(request, "LOAD", 0):
+			printl(DCTL, DINFO, "Recv LOAD cmd")
+
+			if self.app.tmsi_mgr.store is None:
+				printl(DCTL, DERROR, "Recording store isn't configured")
+				return
+
+			self.app.tmsi_mgr.load()
+			printl(DCTL, DINFO, "Loaded %d records"
+				% len(self.app.tmsi_mgr.records))
 
 		elif self.verify_cmd(request, "FLUSH", 0):
 			printl(DCTL, DINFO, "Recv FLUSH cmd")
@@ -219,8 +868,8 @@ class ControlInterface(TCPClient):
 		else:
 			printl(DCTL, DERROR, "Wrong command on CTRL interface")
 
-	def handle_rx_data(self, data):
-		if self.verify_req(data):
+	def handle_rx_frame(self, ftype, data):
+		if ftype == FRAME_TEXT and self.verify_req(data):
 			request = self.prepare_req(data)
 			self.parse_cmd(request)
 		else:
@@ -235,14 +884,54 @@ class Application:
 	master_addr = "127.0.0.1"
 	master_port = 8888
 	local_port = 4729
+	rx_batch = 64
+	rx_rcvbuf = 0
 	quit = False
 
+	# Logging specific variables
+	log_path = None
+	log_paging = "all"
+
+	# Metrics specific variables
+	stats_enabled = False
+	stats_path = None
+
+	# Recording store specific variables
+	store_path = None
+
+	# CROSS specific variables
+	cross_mode = "strict"
+
+	# Paging repetitions window (None means default)
+	dedup = None
+
+	# IDLE mode outsider filtering
+	idle_filter = "exact"
+
+	# Finished records backend
+	record_backend = "set"
+
+	# Replay specific variables
+	replay_path = None
+	replay_speed = 1.0
+
+	# IQ file specific variables
+	iq_path = None
+	iq_fc = None
+	iq_speed = 1.0
+
 	# PHY specific variables
 	phy_sample_rate = 2000000
 	phy_subdev_spec = ""
 	phy_device_args = ""
 	phy_gain = 30
 	phy_ppm = 0
+	phy_carriers = None
+	phy_arfcn = None
+	radio_process = False
+
+	# Scanner specific variables
+	scan_dwell = 2.0
 
 	def __init__(self):
 		self.print_copyright()
@@ -252,20 +941,67 @@ class Application:
 		signal.signal(signal.SIGINT, self.sig_handler)
 
 	def run(self):
+		# Flowgraph in its own process, never starved by
+		# TMSI processing, control or console output.
+		# Forked before any thread (log writer) is running
+		self.radio = None
+		if self.replay_path is None and self.radio_process:
+			from lib.radioproc import RadioProcess
+
+			self.radio = RadioProcess(
+				self.phy_device_args, self.phy_subdev_spec,
+				self.phy_sample_rate, self.phy_gain,
+				self.phy_ppm, self.local_port, self.phy_carriers,
+				self.iq_path, self.iq_fc, self.iq_speed,
+				log_path = self.log_path)
+
+		# Init logging backend
+		self.init_log()
+
 		# Init Control interface
 		self.ctrl = ControlInterface(self)
 		if not self.ctrl.connect(self.master_addr, self.master_port):
+			if self.radio is not None:
+				self.radio.shutdown()
+			log_stop()
 			sys.exit(1)
 
-		# Init Radio interface
-		self.radio = RadioInterface(
-			self.phy_device_args, self.phy_subdev_spec,
-			self.phy_sample_rate, self.phy_gain,
-			self.phy_ppm, self.local_port)
-		self.radio.start()
+		# Init metrics registry
+		self.stats = Stats() if self.stats_enabled else None
+
+		# Init recording store
+		self.store = None
+		if self.store_path is not None:
+			self.store = RecordStore(self.store_path)
 
 		# Init TMSI manager
-		self.tmsi_mgr = TMSIManager(self.local_port)
+		self.tmsi_mgr = TMSIManager(self.local_port,
+			self.rx_batch, self.rx_rcvbuf, self.stats, self.store,
+			self.cross_mode, dedup = self.dedup,
+			idle_filter = self.idle_filter,
+			record_backend = self.record_backend)
+
+		# Either replay a capture, or init Radio interface
+		# (unless it's running in its own process already)
+		self.replay = None
+		self.scanner = None
+		if self.replay_path is not None:
+			self.replay = Replay(self.replay_path, self.replay_speed,
+				self.tmsi_mgr.handle_rx_data)
+		elif self.radio is None:
+			# Import here, so replay works without GR-GSM
+			from lib.radio import RadioInterface
+
+			self.radio = RadioInterface(
+				self.phy_device_args, self.phy_subdev_spec,
+				self.phy_sample_rate, self.phy_gain,
+				self.phy_ppm, self.local_port, self.phy_carriers,
+				self.iq_path, self.iq_fc, self.iq_speed)
+			self.radio.start()
+
+		# Initial carrier, if given
+		if self.radio is not None and self.phy_arfcn is not None:
+			self.radio.set_fc(self.phy_arfcn)
 
 		# Enter main loop
 		printl(DAPP, DINFO, "Init complete, entering main loop...")
@@ -279,9 +1015,22 @@ class Application:
 			self.loop()
 
 	def loop(self):
+		# Wake up in time for the next replayed frame
+		timeout = None
+		if self.replay is not None:
+			timeout = self.replay.timeout()
+
+		# ... or for the next carrier to scan
+		if self.scanner is not None:
+			timeout = self.scanner.timeout()
+
 		# Blocking select
 		r_event, w_event, x_event = select.select(
-			[self.ctrl.sock, self.tmsi_mgr.sock], [], [])
+			[self.ctrl.sock, self.tmsi_mgr.sock], [], [], timeout)
+
+		# Feed replayed GSM data
+		if self.replay is not None:
+			self.replay.handle_timer()
 
 		# Check for incoming GSM data
 		if self.tmsi_mgr.sock in r_event:
@@ -291,11 +1040,30 @@ class Application:
 		if self.ctrl.sock in r_event:
 			self.ctrl.handle_rx_event()
 
+		# Move on to the next carrier
+		if self.scanner is not None:
+			self.scanner.handle_timer()
+
+	def init_log(self):
+		backend = log_start(self.log_path)
+
+		# Paging messages may be disabled or sampled
+		if self.log_paging == "off":
+			backend.disable(DPAGING)
+		elif self.log_paging != "all":
+			backend.sample(DPAGING, int(self.log_paging))
+
 	def shutdown(self):
 		printl(DAPP, DINFO, "Shutting down...")
 		self.ctrl.shutdown()
-		self.radio.shutdown()
+		if self.radio is not None:
+			self.radio.shutdown()
+		if self.replay is not None:
+			self.replay.close()
+		if self.stats_path is not None:
+			self.stats.dump_file(self.stats_path)
 		self.tmsi_mgr.shutdown()
+		log_stop()
 
 	def print_copyright(self):
 		s = "Copyright (C) 2016 by Vadim Yanitskiy <axilirator@gmail.com>\n" \
@@ -309,7 +1077,22 @@ class Application:
 		s  = " Usage: " + sys.argv[0] + " [options]\n\n" \
 			 " Some help...\n" \
 			 "  -h --help         this text\n" \
-			 "  -w --write        Write logs into a file\n\n"
+			 "  -w --write        Write logs into a file\n" \
+			 "     --log-paging   Paging messages: all, off or N to print\n" \
+			 "                    only one of N (default all)\n" \
+			 "     --stats        Collect hot-path metrics (see CMD STATS)\n" \
+			 "     --stats-file   Collect metrics and dump them into a file\n" \
+			 "  -d --store        Persist recordings into a directory\n" \
+			 "     --cross-mode   CROSS results: strict intersection, or\n" \
+			 "                    score to rank by hit ratio (default strict)\n" \
+			 "     --dedup        Seconds to suppress repeated pagings\n" \
+			 "                    of a TMSI (default 1.0, 0 off)\n" \
+			 "     --idle-filter  IDLE outsiders: exact removal from every\n" \
+			 "                    record, or bloom to filter candidates in\n" \
+			 "                    bulk, positives confirmed (default exact)\n" \
+			 "     --records      Finished records: set, array to keep them\n" \
+			 "                    as sorted uint32 arrays, or numpy to do\n" \
+			 "                    the same with NumPy (default set)\n\n"
 
 		# TRX specific
 		s += " Master server specific\n" \
@@ -319,21 +1102,52 @@ class Application:
 		# PHY specific
 		s += " Radio interface specific\n" \
 			 "  -l --local-port   Change a local port (default 8899)\n" \
+			 "     --rx-batch     Max datagrams per wake-up (default 64, 0 off)\n" \
+			 "     --rx-rcvbuf    Set UDP socket receive buffer size\n" \
 			 "  -a --device-args  Set device arguments\n" \
 			 "  -s --sample-rate  Set PHY sample rate (default 2000000)\n" \
 			 "  -S --subdev-spec  Set PHY sub-device specification\n" \
 			 "  -g --gain         Set PHY gain (default 30)\n" \
-			 "     --ppm          Set PHY frequency correction (default 0)\n"
+			 "     --ppm          Set PHY frequency correction (default 0)\n" \
+			 "     --arfcn        Initial carrier, ARFCN or kHz (see below)\n" \
+			 "     --radio-process Run the flowgraph in a separate process\n" \
+			 "     --carriers     Wideband mode, comma separated list of\n" \
+			 "                    carriers within the sample rate\n" \
+			 "     --scan-dwell   Seconds to stay on every carrier during\n" \
+			 "                    CMD SCAN (default 2.0)\n\n"
+
+		# Carrier syntax
+		s += " Carriers are given as ARFCNs (0-1023), frequencies in kHz,\n" \
+			 " and may be prefixed with a band (GSM850, GSM900, DCS1800\n" \
+			 " or PCS1900), e.g. PCS1900:512. DCS1800 is assumed for\n" \
+			 " ARFCNs 512-810 by default.\n\n"
+
+		# Replay specific
+		s += " Replay specific\n" \
+			 "  -r --replay       Replay GSMTAP from a pcap file instead of PHY\n" \
+			 "     --replay-speed Replay speed factor, 0 for max (default 1.0)\n\n"
+
+		# IQ file specific
+		s += " IQ file specific\n" \
+			 "     --iq-file      Decode complex64 samples from a file instead\n" \
+			 "                    of PHY (at the PHY sample rate)\n" \
+			 "     --iq-fc        Center frequency of the recording in kHz\n" \
+			 "     --iq-speed     Speed factor, 0 for max (default 1.0)\n"
 
 		print s
 
 	def parse_argv(self):
 		try:
 			opts, args = getopt.getopt(sys.argv[1:],
-				"w:i:p:l:a:s:S:g:h",
+				"w:i:p:l:a:s:S:g:r:d:h",
 				["help", "arfcn=", "gain=", "ppm=", "write=",
 				"master-addr=", "master-port=", "local-port=",
-				"device-args=", "sample-rate=", "subdev-spec="])
+				"device-args=", "sample-rate=", "subdev-spec=",
+				"rx-batch=", "rx-rcvbuf=", "replay=", "replay-speed=",
+				"stats", "stats-file=", "log-paging=", "store=",
+				"cross-mode=", "carriers=", "iq-file=", "iq-fc=",
+				"iq-speed=", "scan-dwell=", "radio-process", "dedup=",
+				"idle-filter=", "records="])
 		except getopt.GetoptError as err:
 			# Print help and exit
 			self.print_help()
@@ -345,7 +1159,36 @@ class Application:
 				self.print_help()
 				sys.exit(2)
 			elif o in ("-w", "--write"):
-				self.master_addr = v
+				self.log_path = v
+			elif o == "--log-paging":
+				if v not in ("all", "off") and (not v.isdigit() or int(v) == 0):
+					print "[!] Paging log mode should be all, off or N"
+					sys.exit(2)
+				self.log_paging = v
+			elif o == "--stats":
+				self.stats_enabled = True
+			elif o == "--stats-file":
+				self.stats_enabled = True
+				self.stats_path = v
+			elif o in ("-d", "--store"):
+				self.store_path = v
+			elif o == "--cross-mode":
+				if v not in ("strict", "score"):
+					print "[!] CROSS mode should be strict or score"
+					sys.exit(2)
+				self.cross_mode = v
+			elif o == "--dedup":
+				self.dedup = float(v)
+			elif o == "--idle-filter":
+				if v not in ("exact", "bloom"):
+					print "[!] IDLE filter should be exact or bloom"
+					sys.exit(2)
+				self.idle_filter = v
+			elif o == "--records":
+				if v not in ("set", "array", "numpy"):
+					print "[!] Records backend should be set, array or numpy"
+					sys.exit(2)
+				self.record_backend = v
 
 			# Master interface specific
 			elif o in ("-i", "--master-addr"):
@@ -368,12 +1211,55 @@ class Application:
 				self.phy_sample_rate = int(v)
 			elif o in ("--ppm"):
 				self.phy_ppm = int(v)
+			elif o == "--carriers":
+				self.phy_carriers = self.parse_carriers(v)
+			elif o == "--arfcn":
+				self.phy_arfcn = self.parse_carriers(v)[0]
+			elif o == "--scan-dwell":
+				self.scan_dwell = float(v)
+			elif o == "--radio-process":
+				self.radio_process = True
 			elif o in ("-l", "--local-port"):
 				if int(v) >= 0 and int(v) <= 65535:
 					self.local_port = int(v)
 				else:
 					print "[!] Port number should be in range [0-65536]"
 					sys.exit(2)
+			elif o == "--rx-batch":
+				self.rx_batch = int(v)
+			elif o == "--rx-rcvbuf":
+				self.rx_rcvbuf = int(v)
+
+			# Replay specific
+			elif o in ("-r", "--replay"):
+				self.replay_path = v
+			elif o == "--replay-speed":
+				self.replay_speed = float(v)
+
+			# IQ file specific
+			elif o == "--iq-file":
+				self.iq_path = v
+			elif o == "--iq-fc":
+				self.iq_fc = int(v) * 1000
+			elif o == "--iq-speed":
+				self.iq_speed = float(v)
+
+		if self.iq_path is not None and self.iq_fc is None:
+			print "[!] Center frequency of the IQ file is required (--iq-fc)"
+			sys.exit(2)
+
+	def parse_carriers(self, value):
+		try:
+			carriers = sum([parse_channels(v) for v in value.split(",")], [])
+		except Exception as e:
+			print "[!] " + str(e)
+			sys.exit(2)
+
+		if not carriers:
+			print "[!] No known carriers in '%s'" % value
+			sys.exit(2)
+
+		return carriers
 
 	def sig_handler(self, signum, frame):
 		print "Signal %d received" % signum
@@ -25,16 +25,38 @@
 
 import os
 import sys
+import time
 import getopt
 import signal
 
 from lib.network import *
+from lib.tmsiset import *
+from lib.bandplan import *
 from lib.log import *
 
 class CommandLine:
+	stdin_rx_size = 4096
+
+	def __init__(self):
+		# Partial line read from stdin
+		self.rx_buf = ""
+		self.active = True
+
 	def handle_rx_event(self):
-		cmd = sys.stdin.readline()
-		self.handle_cmd(cmd)
+		# Only read what's available, never wait for a whole line
+		data = os.read(sys.stdin.fileno(), self.stdin_rx_size)
+		if len(data) == 0:
+			# Stdin is closed, stop polling it
+			self.active = False
+			return
+
+		lines = (self.rx_buf + data).split("\n")
+		self.rx_buf = lines.pop()
+
+		for cmd in lines:
+			self.handle_cmd(cmd)
+		if lines:
+			self.print_prompt()
 
 	def write(self, data):
 		sys.stdout.write(data)
@@ -48,14 +70,45 @@ class CommandLine:
 		self.write("  clear     clear screen\n")
 		self.write("  exit      shutdown server\n")
 		self.write("\n")
-		self.write("  rxtune    tunes slaves to a given frequency in kHz\n")
+		self.write("  rxtune    tunes slaves to a given carrier\n")
+		self.write("  |         (one per carrier for wideband slaves)\n")
+		self.write("  scan      rank carriers by decoded CCCH rate\n")
+		self.write("  |         carriers are ARFCNs, ranges (1-124), kHz,\n")
+		self.write("  |         bands (GSM900) or e.g. PCS1900:512\n")
+		self.write("  stats     show slave metrics\n")
 		self.write("  paging    TMSI mapping\n")
-		self.write("  |  start  start recording\n")
-		self.write("  |  stop   stop recording\n")
-		self.write("  |  cross  show results\n")
+		self.write("  |  start  start recording (now, or at a given FN)\n")
+		self.write("  |  stop   stop recording (now, or at a given FN)\n")
+		self.write("  |  |  at  at the time of this command instead, on all\n")
+		self.write("  |  |      slaves (their clocks must be in sync, NTP)\n")
+		self.write("  |  cross  show results of all slaves, ranked\n")
+		self.write("  |  |  union  TMSIs found by any slave (default)\n")
+		self.write("  |  |  inter  TMSIs found by every slave\n")
+		self.write("  |  |  (scores of --cross-mode score slaves are averaged)\n")
+		self.write("  |  check  verify results by full recompute\n")
 		self.write("  |  flush  reset all recordings\n")
+		self.write("  |  save   persist all recordings\n")
+		self.write("  |  load   resume persisted recordings\n")
 		self.write("\n")
 
+	def timed_cmd(self, cmd):
+		# Slaves cut windows at the moment of this command,
+		# no matter how late they receive it. Timestamped by
+		# our clock, so the slaves' clocks must be in sync
+		return "CMD %s %d\n" % (cmd, int(time.time() * 1000))
+
+	def parse_carriers(self, argv):
+		# Slaves get plain frequencies in kHz
+		try:
+			freqs = sum([parse_channels(v) for v in argv], [])
+		except Exception as e:
+			self.write("%s\n" % e)
+			return None
+
+		if not freqs:
+			self.write("No known carriers given\n")
+		return freqs
+
 	def print_unknown(self):
 		self.write("Unknown command, see help.\n")
 
@@ -80,8 +133,13 @@ class CommandLine:
 			os.system("clear")
 
 		# Server specific
-		elif cmd == "rxtune" and argc == 1:
-			app.server.broadcast("CMD RXTUNE %s\n" % argv[0])
+		elif cmd in ("rxtune", "scan") and argc >= 1:
+			freqs = self.parse_carriers(argv)
+			if freqs:
+				app.server.broadcast("CMD %s %s\n" % (cmd.upper(),
+					" ".join(str(fc // 1000) for fc in freqs)))
+		elif cmd == "stats":
+			app.server.broadcast("CMD STATS\n")
 		elif cmd == "paging":
 			if argc == 1:
 				subcmd = argv[0]
@@ -90,28 +148,170 @@ class CommandLine:
 				elif subcmd == "stop":
 					app.server.broadcast("CMD STOP\n")
 				elif subcmd == "cross":
-					app.server.broadcast("CMD CROSS\n")
+					app.server.request_cross("union")
+				elif subcmd == "check":
+					app.server.broadcast("CMD CHECK\n")
 				elif subcmd == "flush":
 					app.server.broadcast("CMD FLUSH\n")
+				elif subcmd == "save":
+					app.server.broadcast("CMD SAVE\n")
+				elif subcmd == "load":
+					app.server.broadcast("CMD LOAD\n")
+			elif argc == 2 and argv[0] in ("start", "stop") \
+					and argv[1] == "at":
+				app.server.broadcast(self.timed_cmd(argv[0].upper() + "AT"))
+			elif argc == 2 and argv[0] in ("start", "stop") \
+					and argv[1].isdigit():
+				app.server.broadcast("CMD %s %s\n"
+					% (argv[0].upper(), argv[1]))
+			elif argc == 2 and argv[0] == "cross":
+				if argv[1] in ("union", "inter"):
+					app.server.request_cross(argv[1])
+				else:
+					self.print_unknown()
 
 		# Unknown command
 		elif cmd != "":
 			self.print_unknown()
 
 class Server(TCPServer):
-	def __init__(self):
-		TCPServer.__init__(self)		
+	cross_timeout = 5.0
+
+	def __init__(self, max_conn = None, cross_timeout = None):
+		TCPServer.__init__(self, max_conn)
+
+		if cross_timeout is not None:
+			self.cross_timeout = cross_timeout
+
+		# Slaves we still wait a CROSS result from
+		self.cross_pending = None
 
 	def handle_close_event(self):
 		printl(DCTL, DINFO, "A slave node disconnected")
 
-	def handle_rx_data(self, data):
+	def drop(self, sock):
+		TCPServer.drop(self, sock)
+
+		# Don't wait for this one anymore. A drop may come in
+		# the middle of a broadcast, so handle_timer() finishes
+		if self.cross_pending is not None and sock in self.cross_pending:
+			self.cross_pending.remove(sock)
+			self.cross_total -= 1
+
+	def request_cross(self, mode):
+		if not self.connections:
+			printl(DCTL, DERROR, "No slaves connected")
+			return
+
+		if self.cross_pending is not None:
+			printl(DCTL, DERROR, "Previous CROSS request is still pending")
+			return
+
+		self.cross_mode = mode
+		self.cross_pending = set(self.connections)
+		self.cross_total = len(self.connections)
+		self.cross_ranking = TMSIRanking()
+		self.cross_scores = None
+		self.cross_deadline = time.time() + self.cross_timeout
+		self.broadcast("CMD CROSS\n")
+
+	def timeout(self):
+		# How long select() may sleep
+		if self.cross_pending is None:
+			return None
+		if not self.cross_pending:
+			return 0
+		return max(0, self.cross_deadline - time.time())
+
+	def handle_timer(self):
+		if self.cross_pending is None:
+			return
+
+		# The remaining slaves were dropped
+		if not self.cross_pending:
+			self.finish_cross()
+			return
+
+		if time.time() >= self.cross_deadline:
+			printl(DCTL, DERROR, "%d slave(s) didn't respond in time"
+				% len(self.cross_pending))
+			self.finish_cross()
+
+	def finish_cross(self):
+		ranking = self.cross_ranking
+		total = len(ranking)
+		self.cross_pending = None
+
+		if self.cross_scores is not None:
+			self.finish_cross_scores()
+			return
+
+		if self.cross_mode == "inter":
+			result = [(tmsi, total) for tmsi in sorted(ranking.at_least(total))]
+		else:
+			result = ranking.ranked()
+
+		data = "CROSS Result (%s of %d/%d slaves):\n" \
+			% (self.cross_mode, total, self.cross_total)
+		data += "".join("0x%08x %d/%d\n" % (tmsi, count, total)
+			for tmsi, count in result)
+
+		app.ctrl.write(data)
+		app.ctrl.print_prompt()
+
+	def finish_cross_scores(self):
+		# Average score over all responded slaves, where
+		# strict results count as 1.0 for every TMSI
+		total = len(self.cross_ranking)
+		scores = self.cross_scores
+		for tmsi, count in self.cross_ranking.ranked():
+			scores[tmsi] = scores.get(tmsi, 0.0) + count
+
+		result = sorted(scores.items(), key = lambda x: (-x[1], x[0]))
+
+		data = "CROSS Result (score of %d/%d slaves):\n" \
+			% (total, self.cross_total)
+		data += "".join("0x%08x %.3f\n" % (tmsi, score / total)
+			for tmsi, score in result)
+
+		app.ctrl.write(data)
+		app.ctrl.print_prompt()
+
+	def handle_cross_result(self, sock, ftype, data):
+		if self.cross_pending is None or sock not in self.cross_pending:
+			printl(DCTL, DERROR, "Unexpected CROSS result, ignoring")
+			return
+
+		if ftype == FRAME_SCORES:
+			if self.cross_scores is None:
+				self.cross_scores = {}
+			for tmsi, score in unpack_scores(data):
+				self.cross_scores[tmsi] = \
+					self.cross_scores.get(tmsi, 0.0) + score
+
+			# Still counts as a responded slave
+			self.cross_ranking.add(())
+		else:
+			self.cross_ranking.add(unpack_tmsis(data))
+
+		self.cross_pending.remove(sock)
+		if not self.cross_pending:
+			self.finish_cross()
+
+	def handle_rx_frame(self, sock, ftype, data):
+		# CROSS results come as packed TMSIs or scores
+		if ftype in (FRAME_TMSIS, FRAME_SCORES):
+			self.handle_cross_result(sock, ftype, data)
+			return
+
 		printl(DCTL, DINFO, "Some slave says:")
 		app.ctrl.write(data)
 
 class Application:
 	# Application variables
 	listen_port = 8888
+	max_conn = 10
+	cross_timeout = 5.0
 
 	def __init__(self):
 		self.print_copyright()
@@ -122,37 +322,45 @@ class Application:
 
 	def run(self):
 		self.ctrl = CommandLine()
-		self.server = Server()
+		self.server = Server(self.max_conn, self.cross_timeout)
 		self.server.listen(self.listen_port)
 
 		printl(DAPP, DINFO, "Init complete")
 		self.ctrl.print_help()
 
+		# Provide prompt
+		# TODO: How to save a previous command?
+		self.ctrl.print_prompt()
+
 		# Enter main loop
 		while True:
 			# Keep working
 			self.loop()
 
 	def loop(self):
-		# Provide prompt
-		# TODO: How to save a previous command?
-		self.ctrl.print_prompt()
+		r_list = [self.server.sock] + self.server.connections
+		if self.ctrl.active:
+			r_list.append(sys.stdin)
 
-		# Blocking select
-		r_list = [sys.stdin, self.server.sock] + self.server.connections
-		r_event, w_event, x_event = select.select(r_list, [], [])
+		# Wait for slaves, which still have something to receive
+		w_list = self.server.tx_pending()
 
-		# Check for incoming CTRL commands
-		if sys.stdin in r_event:
-			self.ctrl.handle_rx_event()
+		# Blocking select, unless a CROSS request may time out
+		r_event, w_event, x_event = select.select(r_list, w_list, [],
+			self.server.timeout())
 
-		# Check for incoming data
-		elif self.server.sock in r_event:
+		# Handle all ready events at once
+		if self.server.sock in r_event:
 			self.server.accept()
 
 		# Maybe something from slaves?
-		else:
-			self.server.handle_rx_event(r_event)
+		self.server.handle_rx_event(r_event)
+		self.server.handle_tx_event(w_event)
+		self.server.handle_timer()
+
+		# Check for incoming CTRL commands
+		if sys.stdin in r_event:
+			self.ctrl.handle_rx_event()
 
 	def shutdown(self):
 		printl(DAPP, DINFO, "Shutting down...")
@@ -171,14 +379,16 @@ class Application:
 		s  = " Usage: " + sys.argv[0] + " [options]\n\n" \
 			 " Some help...\n" \
 			 "  -h --help         this text\n" \
-			 "  -p --port         Specify a port to listen (default 8888)\n"
+			 "  -p --port         Specify a port to listen (default 8888)\n" \
+			 "  -c --max-conn     Max number of slaves (default 10)\n" \
+			 "  -t --timeout      CROSS response timeout in seconds (default 5)\n"
 
 		print s
 
 	def parse_argv(self):
 		try:
 			opts, args = getopt.getopt(sys.argv[1:],
-				"p:h", ["help", "port="])
+				"p:c:t:h", ["help", "port=", "max-conn=", "timeout="])
 		except getopt.GetoptError as err:
 			# Print help and exit
 			self.print_help()
@@ -195,6 +405,10 @@ class Application:
 				else:
 					print "[!] Port number should be in range [0-65536]"
 					sys.exit(2)
+			elif o in ("-c", "--max-conn"):
+				self.max_conn = int(v)
+			elif o in ("-t", "--timeout"):
+				self.cross_timeout = float(v)
 
 	def sig_handler(self, signum, frame):
 		print "Signal %d received" % signum